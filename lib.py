@@ -1,19 +1,27 @@
 ########################################################################################3
 # libraries
 ########################################################################################3
-from audioop import add
-from genericpath import exists
-from re import A
-from turtle import pos, position
 import pandas as pd
 import numpy as np
 from dateutil.relativedelta import relativedelta
 import numpy as np
 import itertools
-from IPython.display import clear_output
 import datetime
 import threading
+from multiprocessing import shared_memory
 import os
+import glob
+import json
+import shutil
+import hashlib
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.managers import BaseManager
+import queue
+import socket
+import sys
+import time
+import traceback
 #import mysql.connector
 import warnings
 warnings.simplefilter('ignore')
@@ -39,6 +47,9 @@ else:
 
 DIRECTORY = DIRECTORY.replace(PYTHONFILENAME,"")
 INPUTPATH= DIRECTORY+INPUTPATH
+CACHEPATH = DIRECTORY+"cache/"
+MARKET_SQLITE_PATH = os.getenv("MARKET_SQLITE_PATH", INPUTPATH+"market/market.sqlite")
+TRAIN_CHECKPOINT_PATH = DIRECTORY+"train/output/checkpoint/train_checkpoint.sqlite"
 
 
 ########################################################################################3
@@ -48,6 +59,26 @@ INPUTPATH= DIRECTORY+INPUTPATH
 # 高速化フラグ（True: 高速版使用, False: 既存版使用）
 USE_FAST = True
 
+# 市場データキャッシュフラグ（True: CACHEPATH/market/ の.npyキャッシュを使用, False: 毎回CSVを解析）
+USE_MARKET_CACHE = True
+
+# ファクターリターン保存フラグ（True: CACHEPATH/factor_returns/ に保存・再利用, False: 毎回計算）
+USE_FACTOR_RETURN_STORE = True
+FACTOR_RETURN_STORE_VERSION = 2 # 計算方法を変えて保存済みの値が変わる場合に上げる（保存フォルダのハッシュに含める）
+
+# 結果キャッシュフラグ（True: 入力が変わっていないジョブは CACHEPATH/results/ の出力を再利用, False: 毎回計算）
+USE_RESULT_CACHE = True
+RESULT_CACHE_MAX_BYTES = 2*1024**3 # 結果キャッシュの上限（超えたら最後に使われたのが古い順に削除）
+RESULT_CACHE_VERSION = 1 # 計算方法を変えて同じ入力でも出力が変わる場合に上げる（キャッシュのキーに含める）
+
+# train チェックポイントフラグ（True: 作業単位 × 年ごとの結果を TRAIN_CHECKPOINT_PATH に保存し、再実行時は完了済みを飛ばす。
+# 最終年が進んだ場合は新しい年の結果だけを追加する）
+USE_TRAIN_CHECKPOINT = True
+
+# 本番の成績集計フラグ（True: performance_state_*.json に集計の途中結果を保存し、毎週の追加分だけで
+# performance_summary_*.csv を作る, False: 毎回前回の performance_*.csv を読み込んで全期間を集計）
+USE_PERFORMANCE_STATE = True
+
 CURRENCY_A = ['AUDUSD','CADUSD','CHFUSD','EURUSD','GBPUSD','NZDUSD']
 CURRENCY_B = ['AUDUSD','CADUSD','CHFUSD','EURUSD','GBPUSD','NZDUSD','JPYUSD']
 CURRENCY_C = ['AUDUSD','CADUSD','CHFUSD','EURUSD','GBPUSD','NZDUSD']
@@ -59,6 +90,9 @@ TRADE_PERIOD_WIDTH = [5,12,25,50] #p1
 NUMBER_OF_PARAMETERS = [1,3,5,10] # p4
 NUMBER_OF_HYPERPARAMETER = 4
 THRESHOLD = 0.0008  #LB
+# 格子点の順位付けの指標（"mean": 平均, "sr": 平均/標準偏差*√50, "sortino": 合計/|最大ドローダウン|）。
+# THRESHOLD は指標によらず平均に適用する。"mean" 以外は USE_FAST=True の場合のみ有効
+SIMULATION_RANKING = "mean"
 
 TRAIN_PERIOD_TO_A = range(2005,2024)
 TRAIN_PERIOD_TO_B = range(2006,2024)
@@ -82,35 +116,44 @@ LAG_RANGE = range(1,6)
 
 def loadSQL(date, tenor,pricing_source ):
     """
-    MySQLデータベースから為替レートを読み込む関数
+    ローカルのsqliteデータベースから為替レートを読み込む関数（MySQLの代替）
     
-    ⚠️ セキュリティ警告: 認証情報は環境変数から取得してください
-    現在は未使用のため、空のDataFrameを返します。
+    MARKET_SQLITE_PATH（環境変数 MARKET_SQLITE_PATH で変更可）の market_rates テーブルから、
+    date より後の行を読み込んで通貨ごとの列に展開する。
     
-    環境変数（将来使用する場合）:
-        MYSQL_HOST: データベースホスト
-        MYSQL_PORT: ポート番号（デフォルト: 3306）
-        MYSQL_USER: ユーザー名
-        MYSQL_PASSWORD: パスワード
-        MYSQL_DATABASE: データベース名
+    テーブル定義:
+        market_rates(date_time TEXT 'YYYY-MM-DD', tenor TEXT, pricing_source TEXT, currency TEXT, rate REAL)
     
-    使用例（環境変数を使用）:
-        import os
-        import mysql.connector
-        
-        host = os.getenv("MYSQL_HOST")
-        port = int(os.getenv("MYSQL_PORT", "3306"))
-        user = os.getenv("MYSQL_USER")
-        password = os.getenv("MYSQL_PASSWORD")
-        database = os.getenv("MYSQL_DATABASE")
-        
-        mydb = mysql.connector.connect(host=host, port=port, user=user, password=password, database=database)
+    Args:
+        date: この日時より後のデータを取得する
+        tenor: "1W" または "Spot"
+        pricing_source: "CMPN", "BGNT", "T163"
+    
+    Returns:
+        date_time列と通貨列を持つDataFrame（データベースがない・差分がない場合は空のDataFrame）
     """
-    # 現在は未使用のため、空のDataFrameを返す
-    # 認証情報のハードコードを避けるため、実装はコメントアウト
-    return pd.DataFrame()
+    if not os.path.exists(MARKET_SQLITE_PATH):
+        return pd.DataFrame()
+    
+    con_ = sqlite3.connect(MARKET_SQLITE_PATH)
+    try:
+        data_ = pd.read_sql_query(
+            "SELECT date_time, currency, rate FROM market_rates WHERE tenor = ? AND pricing_source = ? AND date_time > ?",
+            con_, params = (tenor, pricing_source, str(pd.Timestamp(date))))
+    finally:
+        con_.close()
+    if len(data_) == 0:
+        return pd.DataFrame()
+    
+    ret_ = data_.pivot_table(index = "date_time", columns = "currency", values = "rate", aggfunc = "last")
+    ret_.columns.name = None
+    ret_ = ret_.reset_index()
+    ret_["date_time"] = pd.to_datetime(ret_["date_time"])
+    return ret_.sort_values("date_time").reset_index(drop = True)
 
 def imputation(fwdRate_,spotRate_):
+    if USE_FAST:
+        return imputation_fast(fwdRate_, spotRate_)
     for currency_ in fwdRate_.columns.drop("date_time"):
         index_ = fwdRate_.index[fwdRate_[currency_].isna()]
         for i_ in index_ :
@@ -124,13 +167,141 @@ def imputation(fwdRate_,spotRate_):
 
     return fwdRate_
 
-
-def loadData(inputFile_):
+def imputation_fast(fwdRate_, spotRate_):
+    """
+    高速化版: フォワードレートの欠損補完（ベクトル化）
+    
+    スポットレートを日付でフォワードレートに一度だけ揃え、欠損行は
+    前日のフォワード/スポット比 × 当日スポットで埋める。連続欠損は
+    先頭から順に連鎖させるので、既存版と同じ演算順序・同じ結果になる。
+    
+    Args:
+        fwdRate_: フォワードレートDataFrame（date_time列を含む、行は日付順）
+        spotRate_: スポットレートDataFrame（date_time列を含む、同日重複は最後の行を使用）
     
+    Returns:
+        fwdRate_: 欠損を補完したフォワードレートDataFrame
+    """
+    ccyList_ = list(fwdRate_.columns.drop("date_time"))
+    spot_ = spotRate_.drop_duplicates("date_time", keep = "last").set_index("date_time")
+    spot_ = spot_.reindex(fwdRate_["date_time"].values)
+
+    for currency_ in ccyList_ :
+        fwd_ = fwdRate_[currency_].values.astype(np.float64)
+        spotArray_ = spot_[currency_].values.astype(np.float64)
+        missing_ = np.isnan(fwd_)
+        missing_[:1] = False
+        # 欠損の連続長だけ繰り返す（1回で直前が埋まっている行をまとめて補完）
+        while missing_.any():
+            idx_ = np.flatnonzero(missing_)
+            idx_ = idx_[~np.isnan(fwd_[idx_ - 1])]
+            if len(idx_) == 0:
+                break
+            fwd_[idx_] = fwd_[idx_ - 1] / spotArray_[idx_ - 1] * spotArray_[idx_]
+            missing_[idx_] = False
+        fwdRate_[currency_] = fwd_
+
+    return fwdRate_
+
+
+def loadDataCSV(inputFile_):
     ret_ = pd.read_csv( INPUTPATH  + inputFile_).dropna()
     ret_["date_time"] = pd.to_datetime(ret_["date_time"])
     return ret_
 
+def marketCacheFolder(path_):
+    """
+    キャッシュフォルダ名を決める
+    
+    ソースCSVのパスごとに固定の接頭辞を持ち、サイズ・更新時刻が変わると別フォルダになる。
+    """
+    stat_ = os.stat(path_)
+    pathKey_ = hashlib.sha1(os.path.abspath(path_).encode()).hexdigest()[:8]
+    fileKey_ = hashlib.sha1("{}|{}".format(stat_.st_size, stat_.st_mtime_ns).encode()).hexdigest()[:8]
+    prefix_ = CACHEPATH + "market/" + os.path.splitext(os.path.basename(path_))[0] + "_" + pathKey_ + "_"
+    return prefix_, prefix_ + fileKey_
+
+def publishFolder(folder_, write_):
+    """
+    一時フォルダに書き込んでから folder_ に rename する（読む側からは書きかけのフォルダが見えない）
+    
+    他プロセスが先に folder_ を作成した場合はそちらを使い、一時フォルダは削除する。
+    
+    Args:
+        folder_: 作成するフォルダ
+        write_: 一時フォルダのパスを受け取って中身を書き込む関数
+    """
+    tmp_ = folder_.rstrip("/") + ".tmp" + str(os.getpid())
+    os.makedirs(tmp_, exist_ok=True)
+    try:
+        write_(tmp_)
+    except BaseException:
+        shutil.rmtree(tmp_, ignore_errors=True)
+        raise
+    try:
+        os.rename(tmp_, folder_.rstrip("/"))
+    except OSError:
+        shutil.rmtree(tmp_, ignore_errors=True)
+
+def writeMarketCache(folder_, ret_):
+    """date_time（int64エポック）と通貨列（float64行列）を.npyで保存する"""
+    columns_ = [x for x in ret_.columns if x != "date_time"]
+    def write(tmp_):
+        np.save(tmp_ + "/index.npy", np.asarray(ret_.index, dtype=np.int64))
+        np.save(tmp_ + "/date_time.npy", ret_["date_time"].values.view(np.int64))
+        np.save(tmp_ + "/values.npy", np.ascontiguousarray(ret_[columns_].values, dtype=np.float64))
+        with open(tmp_ + "/meta.json", "w") as f:
+            json.dump({"columns": list(ret_.columns), "date_time_dtype": str(ret_["date_time"].dtype),
+                       "range_index": isinstance(ret_.index, pd.RangeIndex)}, f)
+    publishFolder(folder_, write)
+
+def readMarketCache(folder_):
+    with open(folder_ + "/meta.json") as f:
+        meta_ = json.load(f)
+    columns_ = [x for x in meta_["columns"] if x != "date_time"]
+    index_ = np.load(folder_ + "/index.npy", mmap_mode="r")
+    dateTime_ = np.load(folder_ + "/date_time.npy", mmap_mode="r")
+    values_ = np.load(folder_ + "/values.npy", mmap_mode="r")
+    if meta_["range_index"]:
+        index_ = pd.RangeIndex(len(index_))
+    else:
+        index_ = pd.Index(np.array(index_))
+    ret_ = pd.DataFrame(np.array(values_), columns = columns_, index = index_)
+    ret_.insert(meta_["columns"].index("date_time"), "date_time", np.array(dateTime_).view(meta_["date_time_dtype"]))
+    return ret_
+
+def loadData(inputFile_):
+    """
+    市場データCSVを読み込む
+    
+    USE_MARKET_CACHE=True の場合、初回のみCSVを解析して CACHEPATH/market/ に.npyで保存し、
+    以降はソースファイルのパス・サイズ・更新時刻が変わらない限りメモリマップで読み込む。
+    年別パーティション（updateMarket() で作成）がある場合は、パーティションごとに読み込んで連結する。
+    戻り値は loadDataCSV() と同一のDataFrame。
+    """
+    partition_ = partitionFiles(inputFile_)
+    if len(partition_) > 0:
+        return pd.concat([loadData(x) for x in partition_], ignore_index = True)
+
+    if not USE_MARKET_CACHE:
+        return loadDataCSV(inputFile_)
+    
+    prefix_, folder_ = marketCacheFolder(INPUTPATH + inputFile_)
+    if os.path.exists(folder_ + "/meta.json"):
+        return readMarketCache(folder_)
+    
+    ret_ = loadDataCSV(inputFile_)
+    # 通貨列がすべてfloat64の場合のみキャッシュする
+    columns_ = [x for x in ret_.columns if x != "date_time"]
+    if all(ret_[x].dtype == np.float64 for x in columns_) and np.issubdtype(ret_["date_time"].dtype, np.datetime64):
+        os.makedirs(CACHEPATH + "market/", exist_ok=True)
+        writeMarketCache(folder_, ret_)
+        # 古いキャッシュ（ソース更新前のもの）を削除
+        for old_ in glob.glob(prefix_ + "*"):
+            if old_ != folder_ and ".tmp" not in old_:
+                shutil.rmtree(old_, ignore_errors=True)
+    return ret_
+
 def loadForwardRate1w_NY17( ):
     return loadData(inputFile_ = "market/forward_rates_1w_ny17.csv")
 
@@ -152,134 +323,260 @@ def loadSpotRate_TK1630( ):
 ########################################################################################3
 # MARKET UPDATE
 ########################################################################################3
-# FWDRATE_NY17 = loadForwardRate1w_NY17()
-# SPOTRATE_NY17 = loadSpotRate_NY17( )
-# addon_1w_ny17 = loadSQL(FWDRATE_NY17["date_time"].max(), "1W","CMPN")
-# if len(addon_1w_ny17) >0 :
-#     addon_spot_ny17 = loadSQL(SPOTRATE_NY17["date_time"].max(), "Spot","CMPN")
-#     addon_1w_ny17 = imputation(addon_1w_ny17,addon_spot_ny17)
-#     addon_1w_ny17["date_time"] = addon_1w_ny17["date_time"].map( lambda x : x  + relativedelta( hours= 17 )  )
-#     addon_spot_ny17["date_time"] = addon_spot_ny17["date_time"].map( lambda x : x  + relativedelta( hours= 17 )  )
-
-#     FWDRATE_NY17 = FWDRATE_NY17.append(addon_1w_ny17)
-#     SPOTRATE_NY17 = SPOTRATE_NY17.append(addon_spot_ny17) 
-#     FWDRATE_NY17.to_csv( INPUTPATH  +"market/forward_rates_1w_ny17.csv",index=False)
-#     SPOTRATE_NY17.to_csv( INPUTPATH  +"market/spot_rates_ny17.csv",index=False)
-
-
-
-# FWDRATE_TK20 = loadForwardRate1w_TK20()
-# SPOTRATE_TK20 = loadSpotRate_TK20( )
-# addon_1w_tk20 = loadSQL(FWDRATE_TK20["date_time"].max(), "1W","BGNT")
-# if len(addon_1w_tk20) >0 :
-#     addon_spot_tk20 = loadSQL(SPOTRATE_TK20["date_time"].max(), "Spot","BGNT")
-#     addon_1w_tk20 = imputation(addon_1w_tk20,addon_spot_tk20)
-#     addon_1w_tk20["date_time"] = addon_1w_tk20["date_time"].map( lambda x : x  + relativedelta( hours= 20 )  )
-#     addon_spot_tk20["date_time"] = addon_spot_tk20["date_time"].map( lambda x : x  + relativedelta( hours= 20 )  )
-
-#     FWDRATE_TK20 = FWDRATE_TK20.append(addon_1w_tk20)
-#     SPOTRATE_TK20 = SPOTRATE_TK20.append(addon_spot_tk20)
-#     FWDRATE_TK20.to_csv( INPUTPATH  +"market/forward_rates_1w_tk20.csv",index=False)
-#     SPOTRATE_TK20.to_csv( INPUTPATH  +"market/spot_rates_tk20.csv",index=False)
-
-
-
-
-# FWDRATE_TK1630 = loadForwardRate1w_TK1630()
-# SPOTRATE_TK1630 = loadSpotRate_TK1630( )
-# addon_1w_tk1630 = loadSQL(FWDRATE_TK1630["date_time"].max(), "1W","T163")
-# if len(addon_1w_tk1630) >0:
-#     addon_spot_tk1630 = loadSQL(SPOTRATE_TK1630["date_time"].max(), "Spot","T163")
-#     addon_1w_tk1630 = imputation(addon_1w_tk1630,addon_spot_tk1630)
-#     addon_1w_tk1630["date_time"] = addon_1w_tk1630["date_time"].map( lambda x : x  + relativedelta( hours= 16)+  relativedelta(minutes= 30 )   )
-#     addon_spot_tk1630["date_time"] = addon_spot_tk1630["date_time"].map( lambda x : x  + relativedelta( hours= 16)+  relativedelta(minutes= 30 )   )
+# 日次の市場データは sqlite の market_rates テーブル（MySQLの代替）から差分だけ取得し、
+# INPUTPATH/market/partition/<CSV名>/<年>.csv に追記する。
+# パーティションが存在する場合、loadData() は元のCSVではなくパーティションを連結して読み込む。
+# パーティションは DB から差分を追記するときに初めて作る（DB がない環境では元のCSVのまま）。
+
+# 更新対象セッション（ファイル名の接尾辞, pricing_source, 日付からの時刻オフセット）
+MARKET_UPDATE = {
+    "NY17": ("ny17", "CMPN", pd.Timedelta(hours = 17)),
+    "TK20": ("tk20", "BGNT", pd.Timedelta(hours = 20)),
+    "TK1630": ("tk1630", "T163", pd.Timedelta(hours = 16, minutes = 30)),
+}
+
+def partitionFolder(inputFile_):
+    return "market/partition/" + os.path.splitext(os.path.basename(inputFile_))[0] + "/"
+
+def partitionFiles(inputFile_):
+    """
+    パーティション化済みの場合、年順に並べたパーティションCSV（INPUTPATHからの相対パス）を返す
+    """
+    folder_ = partitionFolder(inputFile_)
+    if not os.path.isdir(INPUTPATH + folder_):
+        return []
+    years_ = sorted(int(x[:-4]) for x in os.listdir(INPUTPATH + folder_) if x.endswith(".csv"))
+    return [folder_ + "{}.csv".format(x) for x in years_]
 
-#     FWDRATE_TK1630 = FWDRATE_TK1630.append(addon_1w_tk1630)
-#     SPOTRATE_TK1630 = SPOTRATE_TK1630.append(addon_spot_tk1630)
-#     FWDRATE_TK1630.to_csv( INPUTPATH  +"market/forward_rates_1w_tk1630.csv",index=False)
-#     SPOTRATE_TK1630.to_csv( INPUTPATH  +"market/spot_rates_tk1630.csv",index=False)
+def makePartition(inputFile_):
+    """
+    既存の一括CSVを年ごとのパーティションに分割する（初回のみ）
+    
+    文字列のまま分割するので、各行の書式は元のCSVと同一になる。
+    """
+    folder_ = INPUTPATH + partitionFolder(inputFile_)
+    if os.path.isdir(folder_):
+        return
+    data_ = pd.read_csv(INPUTPATH + inputFile_, dtype = str, keep_default_na = False)
+    year_ = data_["date_time"].str.split("/").str[0].astype(int)
+    def write(tmp_):
+        for y_, part_ in data_.groupby(year_):
+            part_.to_csv(tmp_ + "/{}.csv".format(y_), index = False)
+    publishFolder(folder_, write)
+
+def appendPartition(inputFile_, addon_):
+    """
+    追加分を年ごとのパーティションCSVに追記する（既存行は書き換えない）
+    """
+    makePartition(inputFile_)
+    folder_ = INPUTPATH + partitionFolder(inputFile_)
+    columns_ = pd.read_csv(INPUTPATH + partitionFiles(inputFile_)[-1], nrows = 0).columns
+    addon_ = addon_.reindex(columns = columns_)
+    time_ = addon_["date_time"]
+    addon_["date_time"] = ["{}/{}/{} {:%H:%M}".format(x.year, x.month, x.day, x) for x in time_]
+    for y_, part_ in addon_.groupby(time_.dt.year.values):
+        path_ = folder_ + "{}.csv".format(y_)
+        exists_ = os.path.exists(path_)
+        part_.to_csv(path_, mode = "a" if exists_ else "w", header = not exists_, index = False)
+
+def lastMarketDate(inputFile_):
+    """
+    最終日時を返す（パーティション化済みなら最終パーティション（最新年）だけを読む）
+    """
+    files_ = partitionFiles(inputFile_)
+    return loadData(files_[-1] if len(files_) > 0 else inputFile_)["date_time"].max()
 
+def updateMarket(session_):
+    """
+    セッションの差分データを取得してパーティションに追記する
+    
+    Args:
+        session_: "NY17", "TK20", "TK1630"
+    
+    Returns:
+        追加したフォワードレートの行数（差分がなければ0）
+    
+    DB がない場合や差分がない場合は何もしない（パーティションも作らない）。
+    """
+    if not os.path.exists(MARKET_SQLITE_PATH):
+        return 0
+    suffix_, pricingSource_, offset_ = MARKET_UPDATE[session_]
+    fwdFile_ = "market/forward_rates_1w_{}.csv".format(suffix_)
+    spotFile_ = "market/spot_rates_{}.csv".format(suffix_)
+
+    lastFwd_ = lastMarketDate(fwdFile_)
+    lastSpot_ = lastMarketDate(spotFile_)
+    addonFwd_ = loadSQL(lastFwd_, "1W", pricingSource_)
+    if len(addonFwd_) == 0:
+        return 0
+    addonSpot_ = loadSQL(lastSpot_, "Spot", pricingSource_)
+    addonFwd_ = imputation(addonFwd_, addonSpot_)
+    addonFwd_["date_time"] = addonFwd_["date_time"] + offset_
+    addonSpot_["date_time"] = addonSpot_["date_time"] + offset_
+
+    appendPartition(fwdFile_, addonFwd_)
+    appendPartition(spotFile_, addonSpot_)
+    # 更新前の市場データを参照しないようにメモを破棄する
+    _MARKET_DATA.clear()
+    _RANKING_CACHE.clear()
+    _WEIGHT_CACHE.clear()
+    _FACTOR_RETURN_CACHE.clear()
+    return len(addonFwd_)
 
 
 ########################################################################################3
 # Load DataSet
 ########################################################################################3
 
-FWDRATE_NY17 = loadForwardRate1w_NY17()
-FWDRATE_NY17 = FWDRATE_NY17.rename(columns = {'date_time':'start_time'} )
-FWDRATE_NY17 = FWDRATE_NY17[ (FWDRATE_NY17['start_time'].dt.hour == 17) & (FWDRATE_NY17['start_time'].dt.weekday == 0 )  ].reset_index(drop= True)
-FWDRATE_A_NY17 = FWDRATE_NY17[["start_time"]+ CURRENCY_A ]
-FWDRATE_B_NY17 = FWDRATE_NY17[["start_time"]+ CURRENCY_B ]
-FWDRATE_C_NY17 = FWDRATE_NY17[["start_time"]+ CURRENCY_C ]
-
-FWDRATE_NY17TK20 = FWDRATE_NY17.copy()
-FWDRATE_NY17TK20["start_time"] = FWDRATE_NY17TK20["start_time"].map( lambda x : x + relativedelta(days = 1 ) + relativedelta( hours= 3 )  )
-FWDRATE_A_NY17TK20 = FWDRATE_NY17TK20[["start_time"]+ CURRENCY_A ]
-FWDRATE_B_NY17TK20 = FWDRATE_NY17TK20[["start_time"]+ CURRENCY_B ]
-FWDRATE_C_NY17TK20 = FWDRATE_NY17TK20[["start_time"]+ CURRENCY_C ]
-
-FWDRATE_NY17TK1630 = FWDRATE_NY17.copy()
-FWDRATE_NY17TK1630["start_time"] = FWDRATE_NY17TK1630["start_time"].map( lambda x : x + relativedelta(days = 1 ) - relativedelta( minutes= 30 )  )
-FWDRATE_A_NY17TK1630 = FWDRATE_NY17TK1630[["start_time"]+ CURRENCY_A ]
-FWDRATE_B_NY17TK1630 = FWDRATE_NY17TK1630[["start_time"]+ CURRENCY_B ]
-FWDRATE_C_NY17TK1630 = FWDRATE_NY17TK1630[["start_time"]+ CURRENCY_C ]
-
-FWDRATE_TK20 = loadForwardRate1w_TK20()
-FWDRATE_TK20 = FWDRATE_TK20.rename(columns = {'date_time':'start_time'} )
-FWDRATE_TK20 = FWDRATE_TK20[ (FWDRATE_TK20['start_time'].dt.hour == 20) & (FWDRATE_TK20['start_time'].dt.weekday == 1 )  ].reset_index(drop= True)
-FWDRATE_A_TK20 = FWDRATE_TK20[["start_time"]+ CURRENCY_A ]
-FWDRATE_B_TK20 = FWDRATE_TK20[["start_time"]+ CURRENCY_B ]
-FWDRATE_C_TK20 = FWDRATE_TK20[["start_time"]+ CURRENCY_C ]
-
-FWDRATE_TK1630 = loadForwardRate1w_TK1630()
-FWDRATE_TK1630 = FWDRATE_TK1630.rename(columns = {'date_time':'start_time'} )
-FWDRATE_TK1630 = FWDRATE_TK1630[ (FWDRATE_TK1630['start_time'].dt.hour == 16) & (FWDRATE_TK1630['start_time'].dt.minute == 30 ) &(FWDRATE_TK1630['start_time'].dt.weekday == 1 )  ].reset_index(drop= True)
-FWDRATE_A_TK1630 = FWDRATE_TK1630[["start_time"]+ CURRENCY_A ]
-FWDRATE_B_TK1630 = FWDRATE_TK1630[["start_time"]+ CURRENCY_B ]
-FWDRATE_C_TK1630 = FWDRATE_TK1630[["start_time"]+ CURRENCY_C ]
-
-
-
-
-SPOTRATE_NY17 = loadSpotRate_NY17( )
-SPOTRATE_NY17 = SPOTRATE_NY17.rename(columns = {'date_time':'start_time'} )
-SPOTRATE_NY17 = SPOTRATE_NY17[ (SPOTRATE_NY17['start_time'].dt.hour == 17) & (SPOTRATE_NY17['start_time'].dt.weekday == 0 )  ].reset_index(drop= True)
-SPOTRATE_A_NY17 = SPOTRATE_NY17[["start_time"]+ CURRENCY_A ]
-SPOTRATE_B_NY17 = SPOTRATE_NY17[["start_time"]+ CURRENCY_B ]
-SPOTRATE_C_NY17 = SPOTRATE_NY17[["start_time"]+ CURRENCY_C ]
-
-SPOTRATE_NY17TK20 = SPOTRATE_NY17.copy()
-SPOTRATE_NY17TK20["start_time"] = SPOTRATE_NY17TK20["start_time"].map( lambda x : x + relativedelta(days = 1 ) + relativedelta( hours= 3 )  )
-SPOTRATE_A_NY17TK20 = SPOTRATE_NY17TK20[["start_time"]+ CURRENCY_A ]
-SPOTRATE_B_NY17TK20 = SPOTRATE_NY17TK20[["start_time"]+ CURRENCY_B ]
-SPOTRATE_C_NY17TK20 = SPOTRATE_NY17TK20[["start_time"]+ CURRENCY_C ]
-
-SPOTRATE_NY17TK1630 = SPOTRATE_NY17.copy()
-SPOTRATE_NY17TK1630["start_time"] = SPOTRATE_NY17TK1630["start_time"].map( lambda x : x + relativedelta(days = 1 ) - relativedelta( minutes= 30 )  )
-SPOTRATE_A_NY17TK1630 = SPOTRATE_NY17TK1630[["start_time"]+ CURRENCY_A ]
-SPOTRATE_B_NY17TK1630 = SPOTRATE_NY17TK1630[["start_time"]+ CURRENCY_B ]
-SPOTRATE_C_NY17TK1630 = SPOTRATE_NY17TK1630[["start_time"]+ CURRENCY_C ]
-
-SPOTRATE_TK20 = loadSpotRate_TK20( )
-SPOTRATE_TK20 = SPOTRATE_TK20.rename(columns = {'date_time':'start_time'} )
-SPOTRATE_TK20 = SPOTRATE_TK20[ (SPOTRATE_TK20['start_time'].dt.hour == 20) & (SPOTRATE_TK20['start_time'].dt.weekday == 1 )  ].reset_index(drop= True)
-SPOTRATE_A_TK20 = SPOTRATE_TK20[["start_time"]+ CURRENCY_A ]
-SPOTRATE_B_TK20 = SPOTRATE_TK20[["start_time"]+ CURRENCY_B ]
-SPOTRATE_C_TK20 = SPOTRATE_TK20[["start_time"]+ CURRENCY_C ]
-
-SPOTRATE_TK1630 = loadSpotRate_TK1630( )
-SPOTRATE_TK1630 = SPOTRATE_TK1630.rename(columns = {'date_time':'start_time'} )
-SPOTRATE_TK1630 = SPOTRATE_TK1630[ (SPOTRATE_TK1630['start_time'].dt.hour == 16) & (SPOTRATE_TK1630['start_time'].dt.minute == 30 ) &(SPOTRATE_TK1630['start_time'].dt.weekday == 1 )  ].reset_index(drop= True)
-SPOTRATE_A_TK1630 = SPOTRATE_TK1630[["start_time"]+ CURRENCY_A ]
-SPOTRATE_B_TK1630 = SPOTRATE_TK1630[["start_time"]+ CURRENCY_B ]
-SPOTRATE_C_TK1630 = SPOTRATE_TK1630[["start_time"]+ CURRENCY_C ]
-
+# 市場データは import 時には読み込まず、getMarketData() で初めて要求された時点で
+# (レート種別, セッション, 通貨セット) 単位に構築してメモ化する。
+# multiprocessing の各ワーカーは自分が使うセッション・通貨セットの分だけロードする。
+
+CURRENCY_SET = {"A": CURRENCY_A, "B": CURRENCY_B, "C": CURRENCY_C}
+
+# 市場データの読み込み関数（レート種別, セッション）
+RATE_LOADER = {
+    ("FWDRATE", "NY17"): loadForwardRate1w_NY17,
+    ("FWDRATE", "TK20"): loadForwardRate1w_TK20,
+    ("FWDRATE", "TK1630"): loadForwardRate1w_TK1630,
+    ("SPOTRATE", "NY17"): loadSpotRate_NY17,
+    ("SPOTRATE", "TK20"): loadSpotRate_TK20,
+    ("SPOTRATE", "TK1630"): loadSpotRate_TK1630,
+}
+
+# 観測セッションの抽出条件（minute が None の場合は分を条件にしない）
+SESSION_FILTER = {
+    "NY17": {"hour": 17, "minute": None, "weekday": 0},
+    "TK20": {"hour": 20, "minute": None, "weekday": 1},
+    "TK1630": {"hour": 16, "minute": 30, "weekday": 1},
+}
+
+# 派生セッション: 基準セッションの値を執行時刻にずらしたもの（基準セッション, 時刻オフセット）
+# 新しい執行セッション（例: "NY17TK15", "NY17LN16"）はここに1行追加するだけで
+# getMarketData() / FWDRATE_A_NY17TK15 などから参照できる。
+SESSION_OFFSET = {
+    "NY17TK20": ("NY17", pd.Timedelta(days = 1, hours = 3)),
+    "NY17TK1630": ("NY17", pd.Timedelta(days = 1, minutes = -30)),
+}
+
+_MARKET_DATA = {}
+
+def getMarketData(rateType_, session_, currencySet_=None):
+    """
+    市場データレジストリ（遅延ロード＋メモ化）
+    
+    Args:
+        rateType_: "FWDRATE" または "SPOTRATE"
+        session_: "NY17", "TK20", "TK1630" または派生セッション（"NY17TK20" など）
+        currencySet_: None（全通貨）または "A", "B", "C"
+    
+    Returns:
+        start_time列と通貨列を持つDataFrame（旧グローバル FWDRATE_A_NY17 などと同一）
+    """
+    key_ = (rateType_, session_, currencySet_)
+    if key_ not in _MARKET_DATA:
+        if currencySet_ is not None:
+            ret_ = getMarketData(rateType_, session_)[["start_time"] + CURRENCY_SET[currencySet_]]
+        elif session_ in SESSION_OFFSET:
+            baseSession_, offset_ = SESSION_OFFSET[session_]
+            ret_ = getMarketData(rateType_, baseSession_).copy()
+            ret_["start_time"] = ret_["start_time"] + offset_
+        else:
+            filter_ = SESSION_FILTER[session_]
+            ret_ = RATE_LOADER[(rateType_, session_)]()
+            ret_ = ret_.rename(columns = {'date_time':'start_time'} )
+            mask_ = (ret_['start_time'].dt.hour == filter_["hour"]) & (ret_['start_time'].dt.weekday == filter_["weekday"])
+            if filter_["minute"] is not None:
+                mask_ = mask_ & (ret_['start_time'].dt.minute == filter_["minute"])
+            ret_ = ret_[mask_].reset_index(drop= True)
+        _MARKET_DATA[key_] = ret_
+    return _MARKET_DATA[key_]
+
+def getFwdRate(session_, currencySet_=None):
+    return getMarketData("FWDRATE", session_, currencySet_)
+
+def getSpotRate(session_, currencySet_=None):
+    return getMarketData("SPOTRATE", session_, currencySet_)
+
+def __getattr__(name_):
+    # 旧グローバル名（FWDRATE_NY17, SPOTRATE_C_TK1630 など）での参照を互換維持
+    parts_ = name_.split("_")
+    if parts_[0] in ("FWDRATE", "SPOTRATE") and len(parts_) in (2, 3):
+        session_ = parts_[-1]
+        currencySet_ = parts_[1] if len(parts_) == 3 else None
+        if ( session_ in SESSION_FILTER or session_ in SESSION_OFFSET ) and ( currencySet_ is None or currencySet_ in CURRENCY_SET ):
+            return getMarketData(parts_[0], session_, currencySet_)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name_))
+
+# 共有メモリ上の市場データ（ワーカー側で参照を保持しておく必要がある）
+_SHARED_MEMORY = []
+
+def shareMarketData():
+    """
+    親プロセスで全セッションの市場データを読み込み、数値配列を共有メモリに配置する
+    
+    戻り値のハンドルを multiprocessing.Process の引数でワーカーに渡し、
+    ワーカー側で attachMarketData() を呼ぶと、ゼロコピーのNumPyビューから
+    getMarketData() の全ビュー（派生セッション・通貨セットを含む）が構築される。
+    終了後は親プロセスで releaseMarketData() を呼ぶこと。
+    
+    Returns:
+        handle_: 共有メモリ名・形状・列名・start_timeを含むpicklableなdict
+    """
+    handle_ = {}
+    for rateType_, session_ in RATE_LOADER:
+        df_ = getMarketData(rateType_, session_)
+        columns_ = [x for x in df_.columns if x != "start_time"]
+        values_ = np.ascontiguousarray(df_[columns_].values, dtype=np.float64)
+        shm_ = shared_memory.SharedMemory(create=True, size=max(values_.nbytes, 1))
+        np.ndarray(values_.shape, dtype=np.float64, buffer=shm_.buf)[:] = values_
+        _SHARED_MEMORY.append(shm_)
+        handle_[(rateType_, session_)] = {"name": shm_.name, "shape": values_.shape, "columns": columns_,
+                                          "start_time": df_["start_time"].values}
+    return handle_
+
+def attachMarketData(handle_):
+    """
+    ワーカープロセスで共有メモリの市場データをレジストリに登録する
+    
+    通貨セットの列が連続している場合（CURRENCY_A/C は CURRENCY_B の先頭6列）はビューのまま、
+    連続していない場合のみコピーになる。
+    """
+    for (rateType_, session_), info_ in handle_.items():
+        shm_ = shared_memory.SharedMemory(name=info_["name"])
+        _SHARED_MEMORY.append(shm_)
+        values_ = np.ndarray(info_["shape"], dtype=np.float64, buffer=shm_.buf)
+        sessions_ = [(session_, info_["start_time"])]
+        for derived_, (baseSession_, offset_) in SESSION_OFFSET.items():
+            if baseSession_ == session_:
+                sessions_.append((derived_, info_["start_time"] + offset_.to_timedelta64()))
+        for name_, startTime_ in sessions_:
+            _MARKET_DATA[(rateType_, name_, None)] = sharedFrame(values_, info_["columns"], info_["columns"], startTime_)
+            for set_, currency_ in CURRENCY_SET.items():
+                _MARKET_DATA[(rateType_, name_, set_)] = sharedFrame(values_, info_["columns"], currency_, startTime_)
+
+def sharedFrame(values_, columns_, currency_, startTime_):
+    position_ = [columns_.index(x) for x in currency_]
+    if position_ == list(range(position_[0], position_[0] + len(position_))):
+        view_ = values_[:, position_[0]:position_[0] + len(position_)]
+    else:
+        view_ = values_[:, position_]
+    ret_ = pd.DataFrame(view_, columns = currency_, copy = False)
+    ret_.insert(0, "start_time", startTime_)
+    return ret_
 
+def releaseMarketData(handle_):
+    """親プロセスで共有メモリを解放する（全ワーカーのjoin後に呼ぶ）"""
+    while _SHARED_MEMORY:
+        shm_ = _SHARED_MEMORY.pop()
+        shm_.close()
+        if shm_.name in [x["name"] for x in handle_.values()]:
+            shm_.unlink()
 
 
 def getEndTime(calculateFactorReturn):
     endTime_ = calculateFactorReturn(pd.DataFrame(), 0)[["start_time"]]
-    endTime_["end_time"] = endTime_["start_time"].map( lambda x : x + relativedelta( weeks= 1 ) )
+    endTime_["end_time"] = endTime_["start_time"] + pd.Timedelta(weeks = 1)
     return endTime_.dropna()
 
 ########################################################################################3
@@ -333,8 +630,302 @@ for row_ in range( len(POSITION_B)):
 POSITION_C = POSITION_A
 POSITION_FUNCTIONS_C = POSITION_FUNCTIONS_A
 
+# ポジション関数の一覧表（関数 × 順位）。順位 r のウェイトは POSITION_TABLE_X[関数, r-1]。
+# definitionA / definitionB と同じく float32 で保持する。
+POSITION_TABLE_A = POSITION_A.filter(like = "position_").values.astype('float32')
+POSITION_TABLE_B = POSITION_B.filter(like = "position_").values.astype('float32')
+POSITION_TABLE_C = POSITION_TABLE_A
+
+def positionWeights(rank_, positionTable_):
+    """
+    高速化版: 順位から全ポジション関数のウェイトを一括で引く
+    
+    Args:
+        rank_: 順位DataFrame（rank(axis = 1, method= "min") の結果）
+        positionTable_: POSITION_TABLE_A / B / C
+    
+    Returns:
+        weights_: (関数 × 時点 × 通貨) の float32 配列（欠損を含む時点は除外）
+        index_: weights_ の時点に対応する rank_ の index
+    """
+    rankArray_ = rank_.values
+    rows_ = ~np.isnan(rankArray_).any(axis = 1)
+    return positionTable_[:, rankArray_[rows_].astype(np.intp) - 1], rank_.index[rows_]
+
+def positionWeight(rank_, positionTable_, positionId_):
+    """
+    高速化版: rank_.T.apply( POSITION_FUNCTIONS_X[positionId_], axis=0).T.dropna() と同じ結果を返す
+    """
+    rankArray_ = rank_.values
+    rows_ = ~np.isnan(rankArray_).any(axis = 1)
+    weight_ = positionTable_[positionId_][rankArray_[rows_].astype(np.intp) - 1]
+    return pd.DataFrame(weight_, index = rank_.index[rows_], columns = list(rank_.columns))
+
+
+########################################################################################3
+# performance metrics
+# performanceSummary / performanceSummary2 の年次集計を numpy で計算する。
+# 年ごとの sum / mean / std は pandas の groupby と同じ順序・同じ演算（Kahan 加算、Welford 分散）で
+# 計算するので、既存版と同じ値になる。ドローダウンは累積最大との差の最小値で O(n)。
+########################################################################################3
+
+def maxDrawdown(values_):
+    """
+    累積損益の最大ドローダウン min_{i<j}(values_[j] - values_[i]) を累積最大で O(n) に求める
+    （既存版の min( vec_[i_+1 :] ) - vec_[i_] の最小値と同じ。要素数1以下は0）
+    """
+    if len(values_) <= 1 :
+        return 0
+    return (values_[1:] - np.maximum.accumulate(values_[:-1])).min()
+
+def groupedMatrix(values_, group_):
+    """
+    値を (グループ × グループ内の順番) の行列に並べる（グループ内の順番は元の順番のまま、余りは欠損）
+    
+    Args:
+        values_: 1次元の値
+        group_: values_ と同じ長さのグループ（年など）
+    
+    Returns:
+        groups_: グループの昇順
+        count_: グループごとの要素数
+        matrix_: (グループ × 最大要素数) の配列
+    """
+    order_ = np.argsort(group_, kind = "stable")
+    groups_, start_, count_ = np.unique(group_[order_], return_index = True, return_counts = True)
+    matrix_ = np.full((len(groups_), count_.max() if len(count_) else 0), np.nan)
+    matrix_[np.repeat(np.arange(len(groups_)), count_), np.arange(len(order_)) - np.repeat(start_, count_)] = values_[order_]
+    return groups_, count_, matrix_
+
+def groupedMoments(matrix_, count_):
+    """
+    groupedMatrix の行ごとの合計と標準偏差（ddof=1）を groupby().agg(["sum","std"]) と同じ演算で求める
+    
+    列（グループ内の順番）ごとに全行をまとめて進めるので、ループの回数はグループの最大の要素数になる。
+    
+    Returns:
+        sum_: Kahan 加算による合計
+        std_: Welford 法による標準偏差（要素数1以下は欠損）
+    """
+    sum_ = np.zeros(len(count_))
+    compensation_ = np.zeros(len(count_))
+    mean_ = np.zeros(len(count_))
+    var_ = np.zeros(len(count_))
+    for k_ in range(matrix_.shape[1]):
+        active_ = count_ > k_
+        val_ = matrix_[:, k_]
+        y_ = val_ - compensation_
+        t_ = sum_ + y_
+        compensation_ = np.where(active_, t_ - sum_ - y_, compensation_)
+        sum_ = np.where(active_, t_, sum_)
+        oldmean_ = mean_
+        mean_ = np.where(active_, mean_ + (val_ - oldmean_) / (k_ + 1), mean_)
+        var_ = np.where(active_, var_ + (val_ - mean_) * (val_ - oldmean_), var_)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        std_ = np.where(count_ > 1, np.sqrt(var_ / (count_ - 1)), np.nan)
+    return sum_, std_
+
+def groupedDrawdown(matrix_, count_):
+    """
+    groupedMatrix の行ごとに maxDrawdown を求める（要素数1以下は0）
+    """
+    if matrix_.shape[1] <= 1 :
+        return np.zeros(len(count_))
+    dd_ = matrix_[:, 1:] - np.maximum.accumulate(matrix_, axis = 1)[:, :-1]
+    dd_ = np.where(np.arange(1, matrix_.shape[1]) < count_[:, None], dd_, np.inf).min(axis = 1)
+    return np.where(count_ > 1, dd_, 0.0)
+
+def summaryTables(time_, pl_):
+    """
+    高速化版: (時点 × 戦略) の損益行列から、戦略ごとの年次・全期間の sum / mean / std / sr / mdd / sortino を
+    performanceSummary と同じレイアウト（year を index、最終行が "total"）で一度に求める
+    
+    年次の値は (戦略, 年) を1つのグループにして groupedMoments / groupedDrawdown でまとめて計算する。
+    全期間の値は pandas の Series の sum / mean / std と同じ計算を戦略ごとに行う。
+    
+    Args:
+        time_: start_time の配列
+        pl_: (時点 × 戦略) の損益の配列（戦略ごとに、time_ か損益が欠損の行を除いて集計する）
+    
+    Returns:
+        戦略ごとの年次集計DataFrameのリスト
+    """
+    time_ = pd.DatetimeIndex(time_)
+    pl_ = np.asarray(pl_, dtype = np.float64)
+    if pl_.ndim == 1:
+        pl_ = pl_[:, None]
+    year_ = np.zeros(len(time_), dtype = np.int64)
+    year_[~time_.isna()] = time_[~time_.isna()].year.values
+    strategy_, row_ = np.nonzero((~np.isnan(pl_) & ~time_.isna()[:, None]).T)
+    values_ = pl_[row_, strategy_]
+    bounds_ = np.searchsorted(strategy_, np.arange(pl_.shape[1]+1))
+    cumulative_ = np.empty(len(values_))
+    for s_ in range(pl_.shape[1]):
+        cumulative_[bounds_[s_]:bounds_[s_+1]] = np.cumsum(values_[bounds_[s_]:bounds_[s_+1]])
+    
+    key_ = strategy_ * 10000 + year_[row_]
+    groups_, count_, matrix_ = groupedMatrix(values_, key_)
+    sum_, std_ = groupedMoments(matrix_, count_)
+    mdd_ = groupedDrawdown(groupedMatrix(cumulative_, key_)[2], count_)
+    groupBounds_ = np.searchsorted(groups_ // 10000, np.arange(pl_.shape[1]+1))
+    
+    tables_ = []
+    for s_ in range(pl_.shape[1]):
+        g_ = slice(groupBounds_[s_], groupBounds_[s_+1])
+        tables_.append(summaryFrame(groups_[g_] % 10000, count_[g_], sum_[g_], std_[g_], mdd_[g_],
+                                    *totalMoments(values_[bounds_[s_]:bounds_[s_+1]]), maxDrawdown(cumulative_[bounds_[s_]:bounds_[s_+1]])))
+    return tables_
+
+def totalMoments(pl_):
+    """
+    全期間の個数・合計・標準偏差（pandas の Series の sum / std と同じ計算）
+    """
+    n_ = len(pl_)
+    total_ = pl_.sum()
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        totalStd_ = np.sqrt(((total_ / n_ - pl_)**2).sum() / (n_ - 1)) if n_ > 1 else np.nan
+    return n_, total_, totalStd_
+
+def summaryFrame(years_, count_, sum_, std_, mdd_, n_, total_, totalStd_, totalMdd_):
+    """
+    年ごとの個数・合計・標準偏差・最大ドローダウンと全期間の値から performanceSummary と同じ表を作る
+    
+    Args:
+        years_, count_, sum_, std_, mdd_: 年ごとの値（年の昇順）
+        n_, total_, totalStd_: 全期間の個数・合計・標準偏差（totalMoments の値）
+        totalMdd_: 全期間の最大ドローダウン（maxDrawdown の値）
+    """
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        mean_ = sum_ / count_
+        totalMean_ = total_ / n_
+        sr_ = np.full(len(mean_), -float('inf')) if np.isnan(std_).any() else mean_ / std_ * np.sqrt(50)
+        totalSr_ = -float('inf') if np.isnan(totalStd_) else totalMean_ / totalStd_ * np.sqrt(50)
+        if n_ <= 1 :
+            mdd_ = np.asarray(mdd_).astype(np.int64) # 既存版は全年で要素数1以下のとき整数の0を返す
+        sortino_ = sum_ / np.abs(mdd_)
+        totalSortino_ = total_ / np.abs(np.float64(totalMdd_))
+    return pd.DataFrame({"sum": np.append(sum_, total_), "mean": np.append(mean_, totalMean_),
+                         "std": np.append(std_, totalStd_), "sr": np.append(sr_, totalSr_),
+                         "mdd": np.append(mdd_, totalMdd_), "sortino": np.append(sortino_, totalSortino_)},
+                        index = pd.Index(list(years_) + ["total"], name = "year", dtype = object))
+
+def summaryTable(time_, pl_):
+    """
+    高速化版: 1系列の損益について summaryTables と同じ年次集計を返す
+    """
+    return summaryTables(time_, np.asarray(pl_, dtype = np.float64)[:, None])[0]
+
+# yearStatistics が年ごとに求める値（m2 は年内の平均からの偏差の2乗和、累積は年初を0とした年内の累積損益）
+YEAR_STATISTICS = ["sum", "m2", "min", "max", "last", "mdd"]
+
+def yearStatistics(values_, year_, years_):
+    """
+    (時点 × 戦略) の損益行列について、全戦略に値がある時点の years_ の年ごとの統計を戦略ごとにまとめて求める
+    
+    年内の累積の最小・最大・最後の値と最大ドローダウンを持っておけば、複数年の最大ドローダウンは
+    年の結果をつなげるだけで求まる（expandingStatistics）。分散は2乗和ではなく年内の平均からの
+    偏差の2乗和（m2）で持ち、年をつなげるときに桁落ちしないようにする。
+    
+    Args:
+        values_: (時点 × 戦略) の配列
+        year_: 各時点の年
+        years_: 集計する年のリスト
+    
+    Returns:
+        count_: 年ごとの時点の数
+        stats_: (年 × YEAR_STATISTICS × 戦略) の配列（sum は values_[rows_].sum(axis = 0) と同じ値）
+    """
+    common_ = ~np.isnan(values_).any(axis = 1)
+    stats_ = np.zeros((len(years_), len(YEAR_STATISTICS), values_.shape[1]))
+    count_ = np.zeros(len(years_))
+    for i_, y_ in enumerate(years_):
+        rows_ = common_ & (year_ == y_)
+        year1_ = values_[rows_]
+        count_[i_] = rows_.sum()
+        stats_[i_, 0] = year1_.sum(axis = 0)
+        if len(year1_) == 0:
+            stats_[i_, 2:] = np.array([np.inf, -np.inf, 0, np.inf])[:, None]
+            continue
+        cumulative_ = np.cumsum(year1_, axis = 0)
+        stats_[i_, 1] = ((year1_ - stats_[i_, 0] / len(year1_))**2).sum(axis = 0)
+        stats_[i_, 2] = cumulative_.min(axis = 0)
+        stats_[i_, 3] = cumulative_.max(axis = 0)
+        stats_[i_, 4] = cumulative_[-1]
+        stats_[i_, 5] = (cumulative_[1:] - np.maximum.accumulate(cumulative_[:-1], axis = 0)).min(axis = 0) if len(year1_) > 1 else np.inf
+    return count_, stats_
+
+def expandingStatistics(years_, count_, stats_, simulationPeriod_, columns_):
+    """
+    yearStatistics の年ごとの統計をつなげて、各 simulationTo_ までの sr と sortino を戦略ごとに求める
+    （performanceSummary の total 行と同じ定義。時点が0の年は飛ばし、該当する年がない simulationTo_ は欠損）
+    
+    平均と分散は (個数, 平均, m2) を Chan の並列分散の式で1年ずつ合わせて求める
+    （2乗和から sum*sum/n を引く式は、平均に比べて標準偏差が小さいと桁落ちする）。
+    
+    Returns:
+        "sr", "sortino" をキー、simulationTo_ をindex・戦略を列に持つDataFrameを値に持つdict
+    """
+    years_ = np.asarray(years_)
+    used_ = np.asarray(count_) > 0
+    years_ = years_[used_]
+    count_ = np.asarray(count_, dtype = np.float64)[used_]
+    stats_ = np.asarray(stats_)[used_]
+    width_ = stats_.shape[2] if stats_.ndim == 3 else len(columns_)
+    n_, sum_, mean_, m2_ = 0.0, np.zeros(width_), np.zeros(width_), np.zeros(width_)
+    last_, peak_, mdd_ = np.zeros(width_), np.full(width_, -np.inf), np.full(width_, np.inf)
+    sr_ = np.full((len(years_), width_), np.nan)
+    sortino_ = np.full((len(years_), width_), np.nan)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        for i_ in range(len(years_)):
+            sum1_, m21_, min1_, max1_, last1_, mdd1_ = stats_[i_]
+            mdd_ = np.minimum(np.minimum(mdd_, mdd1_), last_ + min1_ - peak_)
+            peak_ = np.maximum(peak_, last_ + max1_)
+            last_ = last_ + last1_
+            delta_ = sum1_ / count_[i_] - mean_
+            n_ += count_[i_]
+            mean_ = mean_ + delta_ * count_[i_] / n_
+            m2_ = m2_ + m21_ + delta_ * delta_ * (n_ - count_[i_]) * count_[i_] / n_
+            sum_ = sum_ + sum1_
+            std_ = np.sqrt(m2_ / (n_ - 1)) if n_ > 1 else np.full(width_, np.nan)
+            sr_[i_] = np.where(np.isnan(std_), -float('inf'), mean_ / std_ * np.sqrt(50))
+            sortino_[i_] = sum_ / np.abs(np.where(np.isinf(mdd_), 0.0, mdd_))
+    rankings_ = {}
+    for name_, values_ in (("sr", sr_), ("sortino", sortino_)):
+        output_ = np.full((len(simulationPeriod_), width_), np.nan)
+        for j_, simulationTo_ in enumerate(simulationPeriod_):
+            k_ = np.searchsorted(years_, simulationTo_, side = "right")
+            if k_ > 0:
+                output_[j_] = values_[k_-1]
+        rankings_[name_] = pd.DataFrame(output_, index = list(simulationPeriod_), columns = columns_)
+    return rankings_
+
+def compoundReturn(pl_):
+    """
+    pl_ * (pl_+1).shift(1).fillna(1).cumprod() を numpy で計算する（performanceSummary2 の複利換算）
+    """
+    pl_ = np.asarray(pl_, dtype = np.float64)
+    growth_ = np.ones(len(pl_))
+    growth_[1:] = pl_[:-1] + 1
+    growth_[np.isnan(growth_)] = 1
+    return pl_ * np.cumprod(growth_)
+
+def performanceSummary_fast(df_, column_ ) :
+    """
+    高速化版: performanceSummary と同じ年次集計を summaryTable で計算する
+    """
+    df_ = df_.reset_index(drop=False)
+    return summaryTable(df_["start_time"].values, df_[column_].values)
+
+def performanceSummary2_fast(df_, column_ ) :
+    """
+    高速化版: performanceSummary2（複利換算した損益の年次集計）を summaryTable で計算する
+    """
+    df_ = df_.reset_index(drop=False)
+    return summaryTable(df_["start_time"].values, compoundReturn(df_[column_].values))
 
 def performanceSummary(df_, column_ ) :
+    if USE_FAST:
+        return performanceSummary_fast(df_, column_)
     def mdd(vec_):
         vec_ = list( vec_[ vec_.columns[1] ]) 
         if len(vec_) <= 1 :
@@ -389,6 +980,8 @@ def performanceSummary(df_, column_ ) :
     return smry_
 
 def performanceSummary2(df_, column_ ) :
+    if USE_FAST:
+        return performanceSummary2_fast(df_, column_)
     def mdd(vec_):
         vec_ = list( vec_[ vec_.columns[1] ]) 
         if len(vec_) <= 1 :
@@ -444,6 +1037,145 @@ def performanceSummary2(df_, column_ ) :
     return smry_
 
 
+def performanceSummaries(items_):
+    """
+    [(df_, column_, compound_), ...] のそれぞれについて performanceSummary（compound_=True なら performanceSummary2）
+    と同じ表を返す（USE_FAST=True なら全系列を並べた行列から summaryTables で一度に計算する）
+    
+    Args:
+        items_: (start_time を列か index に持つDataFrame, 損益の列名, 複利換算するか) のリスト
+    
+    Returns:
+        items_ の順の年次集計DataFrameのリスト
+    """
+    if not USE_FAST:
+        return [(performanceSummary2 if compound_ else performanceSummary)(df_, column_) for df_, column_, compound_ in items_]
+    time_ = []
+    pl_ = []
+    for df_, column_, compound_ in items_:
+        df_ = df_.reset_index(drop=False)
+        time_.append(df_["start_time"].values)
+        pl_.append(compoundReturn(df_[column_].values) if compound_ else np.asarray(df_[column_].values, dtype = np.float64))
+    # 系列ごとに別の行に置く（他の系列の行は欠損なので集計から除かれ、各系列の行の順番も保たれる）
+    matrix_ = np.full((sum(len(p_) for p_ in pl_), len(pl_)), np.nan)
+    start_ = 0
+    for s_, p_ in enumerate(pl_):
+        matrix_[start_:start_+len(p_), s_] = p_
+        start_ += len(p_)
+    return summaryTables(np.concatenate(time_) if len(time_) else np.array([], dtype = "datetime64[ns]"), matrix_)
+
+def newPerformanceState():
+    """
+    performanceSummary2 の集計を1行ずつ進めるための状態（JSON で保存できる一定サイズの値だけを持つ）
+    
+    growth / factor: 複利換算の (損益+1).shift(1).fillna(1).cumprod() の途中の値と次の行の掛け数
+    last: 最後に加えた行の start_time（ナノ秒、これ以前の行は重複として飛ばす）
+    cumulative / peak / mdd: 複利換算した損益の累積、それまでの累積の最大値、最大ドローダウン
+    total: 全期間の [個数, Kahan 加算の合計, 補正値, Welford の平均, 偏差平方和]
+    years: 年 → [total と同じ5つ, 年内の累積の最大値, 年内の最大ドローダウン]
+    """
+    return {"growth": 1.0, "factor": 1.0, "last": None, "cumulative": 0.0, "peak": -float('inf'), "mdd": float('inf'),
+            "total": [0, 0.0, 0.0, 0.0, 0.0], "years": {}}
+
+def updateMoments(moments_, value_):
+    """[個数, 合計, 補正値, 平均, 偏差平方和] を1つの値で更新する（groupby の sum / std と同じ Kahan 加算と Welford 法）"""
+    count_, sum_, compensation_, mean_, m2_ = moments_[:5]
+    count_ += 1
+    y_ = value_ - compensation_
+    t_ = sum_ + y_
+    compensation_ = t_ - sum_ - y_
+    oldmean_ = mean_
+    mean_ += (value_ - oldmean_) / count_
+    m2_ += (value_ - mean_) * (value_ - oldmean_)
+    moments_[:5] = [count_, t_, compensation_, mean_, m2_]
+
+def updatePerformanceState(state_, time_, pl_):
+    """
+    1行分の損益を状態に加える（O(1)）。start_time か複利換算した損益が欠損の行は複利の掛け数だけ進める
+    """
+    state_["growth"] = state_["growth"] * state_["factor"]
+    value_ = pl_ * state_["growth"]
+    state_["factor"] = pl_ + 1 if pl_ == pl_ else 1.0
+    if pd.isna(time_):
+        return
+    time_ = pd.Timestamp(time_)
+    state_["last"] = time_.value
+    if value_ != value_:
+        return
+    
+    cumulative_ = state_["cumulative"] + value_
+    state_["cumulative"] = cumulative_
+    state_["mdd"] = min(state_["mdd"], cumulative_ - state_["peak"])
+    state_["peak"] = max(state_["peak"], cumulative_)
+    updateMoments(state_["total"], value_)
+    
+    year_ = state_["years"].setdefault(str(time_.year), [0, 0.0, 0.0, 0.0, 0.0, -float('inf'), float('inf')])
+    updateMoments(year_, value_)
+    year_[6] = min(year_[6], cumulative_ - year_[5])
+    year_[5] = max(year_[5], cumulative_)
+
+def appendPerformance(state_, df_, column_ = "total"):
+    """
+    df_ のうち、start_time が状態の最後の行より後の行を元の順に加える
+    （本番の出力は start_time の昇順なので、既存版の concat → drop_duplicates("start_time") と同じ行になる）
+    
+    Returns:
+        加えた行のDataFrame
+    """
+    rows_ = []
+    for i_, (time_, pl_) in enumerate(zip(df_["start_time"], df_[column_])):
+        if not pd.isna(time_) and state_["last"] is not None and pd.Timestamp(time_).value <= state_["last"]:
+            continue
+        updatePerformanceState(state_, time_, float(pl_))
+        rows_.append(i_)
+    return df_.iloc[rows_]
+
+def performanceStateSummary(state_):
+    """
+    高速化版: 状態から performanceSummary2 と同じ表を作る（過去の行は読まない）
+    
+    年ごとの行は既存版と同じ値になる。全期間の sum / std は Kahan 加算と Welford 法で求めるので、
+    pandas の Series（ペアワイズ加算と2パスの分散）とは最後の数桁（相対 1e-15 程度）が異なることがある。
+    """
+    years_ = sorted(state_["years"], key = int)
+    year_ = np.array([state_["years"][y_] for y_ in years_], dtype = np.float64).reshape(len(years_), 7)
+    count_ = year_[:, 0].astype(np.int64)
+    n_, total_, m2_ = state_["total"][0], state_["total"][1], state_["total"][4]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        std_ = np.where(count_ > 1, np.sqrt(year_[:, 4] / (count_ - 1)), np.nan)
+    mdd_ = np.where(count_ > 1, year_[:, 6], 0.0)
+    totalStd_ = np.sqrt(m2_ / (n_ - 1)) if n_ > 1 else np.nan
+    return summaryFrame(np.array([int(y_) for y_ in years_], dtype = np.int64), count_, year_[:, 1], std_, mdd_,
+                        n_, np.float64(total_), totalStd_, state_["mdd"] if n_ > 1 else 0)
+
+def performanceStateFile(dateString_):
+    """date_（YYYYMMDD）の performance_*.csv に対応する状態のファイル"""
+    return DIRECTORY+"test/output/performance/performance_state"+"_"+ dateString_ +  ".json"
+
+def loadPerformanceState(dateString_):
+    """保存済みの状態（USE_PERFORMANCE_STATE=False またはファイルがない場合は None）"""
+    if not USE_PERFORMANCE_STATE or not os.path.exists(performanceStateFile(dateString_)):
+        return None
+    with open(performanceStateFile(dateString_)) as f:
+        return json.load(f)
+
+def savePerformanceState(state_, dateString_):
+    """状態を保存する（一時ファイルに書いてから置き換える）"""
+    if not USE_PERFORMANCE_STATE:
+        return
+    tmp_ = performanceStateFile(dateString_) + ".tmp"
+    with open(tmp_, "w") as f:
+        json.dump(state_, f)
+    os.replace(tmp_, performanceStateFile(dateString_))
+
+def performanceStateFromFile(file_):
+    """performance_*.csv の全行から状態を作る（ファイルに書かれた値をそのまま読む）"""
+    df_ = pd.read_csv(file_, float_precision = "round_trip")
+    df_["start_time"] = pd.to_datetime(df_["start_time"])
+    state_ = newPerformanceState()
+    appendPerformance(state_, df_)
+    return state_
+
 ########################################################################################3
 # simulation functionsonRate_
 ########################################################################################3    
@@ -620,9 +1352,373 @@ def makeFactorReturn_fast(factorReturns_, ranking_, cprd_, fwdRate_, spotRate_,
 
 
 
+def pairFactorReturns(factorReturnsDict_, positionId1_, positionId2_):
+    """
+    ペアのファクターリターンを返す
+    
+    pd.merge( factorReturnsDict_[positionId1_], factorReturnsDict_[positionId2_], on =["start_time","end_time"],how="inner") と同じ結果。
+    USE_FAST=True で両者が同じ時点列（makeFactorReturnAll の結果は全関数で共通）の場合は結合せず、
+    両者のウィンドウ列を np.column_stack で1つの配列にコピーして DataFrame を1回だけ作る
+    （コピーは 時点 × ウィンドウ数 × 2 の float64 1回分で、pd.merge の結合・中間コピーはしない）。
+    
+    Args:
+        factorReturnsDict_: {position_id_: factorReturns_}
+        positionId1_, positionId2_: ポジション関数ID
+    
+    Returns:
+        start_time, end_time, 各ウィンドウ列（_x / _y 付き）を持つDataFrame
+    """
+    left_ = factorReturnsDict_[positionId1_]
+    if positionId1_ == positionId2_:
+        return left_
+    right_ = factorReturnsDict_[positionId2_]
+    
+    keys_ = ["start_time", "end_time"]
+    if USE_FAST and list(left_.columns[:2]) == keys_ and list(right_.columns[:2]) == keys_ \
+            and list(left_.columns[2:]) == list(right_.columns[2:]) and len(left_) == len(right_) \
+            and (left_.dtypes[2:] == np.float64).all() and (right_.dtypes[2:] == np.float64).all() \
+            and np.array_equal(left_["start_time"].values, right_["start_time"].values) \
+            and np.array_equal(left_["end_time"].values, right_["end_time"].values) \
+            and not left_["start_time"].duplicated().any():
+        columns_ = list(left_.columns[2:])
+        values_ = np.column_stack([left_[x].values for x in columns_] + [right_[x].values for x in columns_])
+        ret_ = pd.DataFrame(values_, columns = [x + "_x" for x in columns_] + [x + "_y" for x in columns_], copy = False)
+        ret_.insert(0, "end_time", left_["end_time"].values)
+        ret_.insert(0, "start_time", left_["start_time"].values)
+        return ret_
+    
+    return pd.merge( left_, right_, on =keys_,how="inner")
+
+def rollingStatistics(values_, windows_):
+    """
+    複数ウィンドウのローリング平均・標準偏差を一括計算する
+    
+    ウィンドウごとに、各時点のウィンドウ内の値だけから平均を求め、その平均からの偏差で
+    標準偏差を求める（2パス）。各時点の値はその時点までのデータだけで決まり、後から時点を
+    追加しても変わらない。pandas の rolling(w).mean() / rolling(w).std() と同じく、
+    ウィンドウ内に欠損を含む時点・先頭 w-1 時点は NaN、標準偏差は ddof=1、
+    全て同じ値のウィンドウは平均がその値・標準偏差が0になる。
+    
+    Args:
+        values_: (時点 × 通貨) の配列
+        windows_: ウィンドウ幅のリスト
+    
+    Returns:
+        mean_, std_: それぞれ (ウィンドウ × 時点 × 通貨) の配列
+    """
+    values_ = np.asarray(values_, dtype = np.float64)
+    nTime_, nCcy_ = values_.shape
+    # ウィンドウ内の値がメモリ上で連続するように (通貨 × 時点) にしておく
+    byCcy_ = np.ascontiguousarray(values_.T)
+    mean_ = np.full((len(windows_), nTime_, nCcy_), np.nan)
+    std_ = np.full((len(windows_), nTime_, nCcy_), np.nan)
+    for k_, w_ in enumerate(windows_):
+        if w_ > nTime_:
+            continue
+        # (通貨 × 時点 × ウィンドウ内の位置) のビュー（欠損を含むウィンドウは平均・標準偏差とも NaN になる）
+        window_ = np.lib.stride_tricks.sliding_window_view(byCcy_, w_, axis = 1)
+        m_ = window_.mean(axis = 2)
+        constant_ = window_.max(axis = 2) == window_.min(axis = 2)
+        mean_[k_, w_-1:] = np.where(constant_, byCcy_[:, w_-1:], m_).T
+        if w_ > 1:
+            d_ = window_ - m_[:, :, None]
+            std_[k_, w_-1:] = np.where(constant_, 0.0, np.sqrt((d_ * d_).sum(axis = 2) / (w_ - 1))).T
+    return mean_, std_
+
+def factorSignalA(fwdRate_):
+    """
+    ファクターAのシグナル（ローリング標準偏差）を全ウィンドウ分まとめて作る
+    
+    Returns:
+        {cprd_: start_timeをindexに持つDataFrame}
+    """
+    fwdRate_ = fwdRate_.set_index("start_time")
+    _, std_ = rollingStatistics(fwdRate_.values, list(FACTOR_CALCULATION_PERIOD_A))
+    return {cprd_: pd.DataFrame(std_[k_], index = fwdRate_.index, columns = fwdRate_.columns) for k_, cprd_ in enumerate(FACTOR_CALCULATION_PERIOD_A)}
+
+def factorSignalB(fwdRate_):
+    """
+    ファクターBのシグナル（ローリング平均からの乖離）を全ウィンドウ分まとめて作る
+    
+    Returns:
+        {cprd_: start_timeをindexに持つDataFrame}
+    """
+    fwdRate_ = fwdRate_.set_index("start_time")
+    mean_, _ = rollingStatistics(fwdRate_.values, list(FACTOR_CALCULATION_PERIOD_B))
+    return {cprd_: pd.DataFrame(fwdRate_.values - mean_[k_], index = fwdRate_.index, columns = fwdRate_.columns) for k_, cprd_ in enumerate(FACTOR_CALCULATION_PERIOD_B)}
+
+
+def factorSignalC(fwdRate_):
+    """
+    ファクターCのシグナル（変化率）を全ウィンドウ分まとめて作る
+    
+    Returns:
+        {cprd_: start_timeをindexに持つDataFrame}
+    """
+    fwdRate_ = fwdRate_.set_index(["start_time"])
+    return {cprd_: fwdRate_.pct_change(cprd_) for cprd_ in FACTOR_CALCULATION_PERIOD_C}
+
+def makeFactorReturnBatch(rank_, positionTable_, fwdRate_, spotRate_, swap_df=None):
+    """
+    高速化版: 1ウィンドウ分のファクターリターンを全ポジション関数まとめて計算する
+    
+    ポジション関数は順位ごとのウェイトなので、順位から全関数のウェイト（関数 × 時点 × 通貨）を一度に引き、
+    リターンとコストは全関数まとめて計算する。時点の揃え方と通貨方向の加算順序は makeFactorReturn_fast と同じ
+    （通貨ごとの ror * position - cost を連続な軸で合計する）なので、結果は makeFactorReturn_fast と一致する。
+    
+    Args:
+        rank_: 順位DataFrame（start_timeをindexに持つ）
+        positionTable_: POSITION_TABLE_A / B / C
+        fwdRate_: フォワードレートDataFrame（start_time列を含む）
+        spotRate_: スポットレートDataFrame（start_time列を含む）
+        swap_df: スワップ損益DataFrame（Optional）
+    
+    Returns:
+        start_time, end_time, pl_（関数 × 時点）のタプル。共通の時点がない場合は None
+    """
+    ccyList_ = list(fwdRate_.columns)
+    ccyList_.remove("start_time")
+    
+    weights_, rankIndex_ = positionWeights(rank_, positionTable_)
+    fwdRate_idx = fwdRate_.set_index("start_time")
+    spotRate_idx = spotRate_.set_index("start_time")
+    
+    common_idx = rankIndex_.intersection(fwdRate_idx.index).intersection(spotRate_idx.index)
+    if len(common_idx) == 0:
+        return None
+    end_time_series = pd.Series(common_idx, index=common_idx).shift(-1)
+    valid_idx = common_idx[~end_time_series.isna()]
+    end_time_valid = end_time_series.loc[valid_idx].values
+    
+    fwdRate_array = fwdRate_idx.reindex(valid_idx)[ccyList_].values.astype(np.float64)
+    spotRate_array = spotRate_idx.reindex(end_time_valid)[ccyList_].values.astype(np.float64)
+    ror_array = np.divide(spotRate_array, fwdRate_array, out=np.zeros_like(spotRate_array), where=fwdRate_array!=0) - 1.0
+    
+    # 全関数のウェイト: 関数 × 時点 × 通貨
+    position_array = weights_[:, rankIndex_.get_indexer(valid_idx)].astype(np.float64)
+    
+    # コスト: ウェイト差分（最初の行はウェイトそのまま）× COST/2
+    weight_diff = position_array.copy()
+    weight_diff[:, 1:] = np.diff(position_array, axis=1)
+    cost_row = np.array([COST.get(ccy, 2.0E-4) / 2.0 for ccy in ccyList_], dtype=np.float64)
+    cost_table = np.abs(weight_diff * cost_row)
+    
+    # PL: 通貨ごとの ror * position - cost の合計（関数 × 時点）
+    pl_array = np.sum(ror_array * position_array - cost_table, axis=2)
+    
+    if swap_df is not None:
+        swap_idx = swap_df.set_index("start_time") if "start_time" in swap_df.columns else swap_df
+        swap_aligned = swap_idx.reindex(valid_idx)[ccyList_]
+        if not swap_aligned.empty and not swap_aligned.isna().all().all():
+            swap_array = swap_aligned.fillna(0).values.astype(np.float64)
+            pl_array = pl_array + (position_array * swap_array).sum(axis=2)
+    
+    return valid_idx, end_time_valid, pl_array
+
+def makeFactorReturnAll(ranking_, positionTable_, fwdRate_, spotRate_, swap_df=None):
+    """
+    高速化版: 全ポジション関数のファクターリターンを一括計算する
+    
+    Args:
+        ranking_: {cprd_: 順位DataFrame}（factorRanking() の結果）
+        positionTable_: POSITION_TABLE_A / B / C
+    
+    Returns:
+        {position_id_: factorReturns_}（makeFactorReturnX(pd.DataFrame(), position_id_, ...) と同じ形式）
+    """
+    index_ = None
+    result_ = {}
+    for cprd_, rank_ in ranking_.items():
+        ret_ = makeFactorReturnBatch(rank_, positionTable_, fwdRate_, spotRate_, swap_df=swap_df)
+        if ret_ is None:
+            continue
+        start_, end_, pl_ = ret_
+        # makeFactorReturn_fast の結合と同じく、start_timeの共通部分に絞り、end_timeは最新のもので上書き
+        if index_ is None or len(index_.intersection(start_)) == 0:
+            index_ = start_
+            result_ = {}
+        else:
+            index_ = index_.intersection(start_)
+        endTime_ = end_[start_.get_indexer(index_)]
+        result_[str(cprd_)] = (start_, pl_)
+    
+    if index_ is None:
+        return {id_: pd.DataFrame() for id_ in range(len(positionTable_))}
+    
+    factorReturns_ = {}
+    for id_ in range(len(positionTable_)):
+        columns_ = {"start_time": index_.values, "end_time": endTime_}
+        for name_, (start_, pl_) in result_.items():
+            columns_[name_] = pl_[id_][start_.get_indexer(index_)]
+        factorReturns_[id_] = pd.DataFrame(columns_)
+    return factorReturns_
+
+# ファクター種別ごとのシグナル関数・ポジション関数表・ウィンドウ
+FACTOR_FAMILY = {
+    "A": (factorSignalA, POSITION_TABLE_A, FACTOR_CALCULATION_PERIOD_A),
+    "B": (factorSignalB, POSITION_TABLE_B, FACTOR_CALCULATION_PERIOD_B),
+    "C": (factorSignalC, POSITION_TABLE_C, FACTOR_CALCULATION_PERIOD_C),
+}
+
+# 順位・ウェイト・ファクターリターンのメモ。キーにはシグナル元DataFrameのidを使い、
+# エントリにDataFrame自体を保持してidの再利用を防ぐ。
+_RANKING_CACHE = {}
+_WEIGHT_CACHE = {}
+_FACTOR_RETURN_CACHE = {}
+
+def factorRanking(family_, fwdRate_):
+    """
+    全ウィンドウの順位（rank(axis = 1, method= "min")）をメモ化して返す
+    
+    makeFactorReturnX と makeWeightX で共有する。
+    
+    Args:
+        family_: "A", "B", "C"
+        fwdRate_: シグナル元のフォワードレートDataFrame
+    
+    Returns:
+        {cprd_: 順位DataFrame}
+    """
+    key_ = (family_, id(fwdRate_))
+    entry_ = _RANKING_CACHE.get(key_)
+    if entry_ is None or entry_[0] is not fwdRate_:
+        signal_ = FACTOR_FAMILY[family_][0](fwdRate_)
+        entry_ = (fwdRate_, {cprd_: sig_.rank(axis = 1, method= "min") for cprd_, sig_ in signal_.items()})
+        _RANKING_CACHE[key_] = entry_
+    return entry_[1]
+
+def factorWeight(family_, fwdRate_, cprd_, positionId_):
+    """
+    1ウィンドウ・1ポジション関数のウェイトをメモ化して返す（呼び出し側で変更しないこと）
+    """
+    key_ = (family_, id(fwdRate_), cprd_, positionId_)
+    entry_ = _WEIGHT_CACHE.get(key_)
+    if entry_ is None or entry_[0] is not fwdRate_:
+        rank_ = factorRanking(family_, fwdRate_)[cprd_]
+        entry_ = (fwdRate_, positionWeight(rank_, FACTOR_FAMILY[family_][1], positionId_))
+        _WEIGHT_CACHE[key_] = entry_
+    return entry_[1]
+
+def cachedWeight(family_, fwdRate_, positionId1_, positionId2_):
+    """
+    高速化版 makeWeightX: メモ化した関数ごとのウェイトを組み合わせてペアのウェイトを作る
+    """
+    weight_ = {}
+    for cprd_ in factorRanking(family_, fwdRate_):
+        if positionId1_ == positionId2_:
+            weight_[str(cprd_)] = factorWeight(family_, fwdRate_, cprd_, positionId1_)
+        else:
+            weight_[str(cprd_)+"_x"] = factorWeight(family_, fwdRate_, cprd_, positionId1_)
+            weight_[str(cprd_)+"_y"] = factorWeight(family_, fwdRate_, cprd_, positionId2_)
+    return weight_
+
+def marketSessionName(frame_):
+    """
+    市場データレジストリに登録済みのDataFrameからセッション名を引く（未登録なら None）
+    """
+    for (rateType_, session_, currencySet_), data_ in _MARKET_DATA.items():
+        if data_ is frame_:
+            return session_
+    return None
+
+def frameFingerprint(hash_, frame_):
+    hash_.update(json.dumps(list(frame_.columns)).encode())
+    hash_.update(np.ascontiguousarray(frame_["start_time"].values.view(np.int64)).tobytes())
+    hash_.update(np.ascontiguousarray(frame_.drop(columns = "start_time").values, dtype = np.float64).tobytes())
+
+def factorReturnStoreFolder(family_, fwdRateFactor_, fwdRatePosition_, spotRate_):
+    """
+    ファクターリターン保存フォルダ名を決める
+    
+    (ファクター種別, シグナルセッション, 執行セッション) ごとに固定の接頭辞を持ち、
+    入力レート・COST・ウィンドウ・ポジション関数表・FACTOR_RETURN_STORE_VERSION が変わると別フォルダになる。
+    レジストリ外のDataFrameが渡された場合は保存しない（None, None を返す）。
+    """
+    signalSession_ = marketSessionName(fwdRateFactor_)
+    execSession_ = marketSessionName(fwdRatePosition_)
+    if signalSession_ is None or execSession_ is None or marketSessionName(spotRate_) != execSession_:
+        return None, None
+    hash_ = hashlib.sha1()
+    hash_.update(str(FACTOR_RETURN_STORE_VERSION).encode())
+    for frame_ in (fwdRateFactor_, fwdRatePosition_, spotRate_):
+        frameFingerprint(hash_, frame_)
+    hash_.update(json.dumps(sorted(COST.items())).encode())
+    hash_.update(json.dumps(list(FACTOR_FAMILY[family_][2])).encode())
+    hash_.update(FACTOR_FAMILY[family_][1].tobytes())
+    prefix_ = CACHEPATH + "factor_returns/{}_{}_{}_".format(family_, signalSession_, execSession_)
+    return prefix_, prefix_ + hash_.hexdigest()[:16]
+
+def writeFactorReturnStore(folder_, frames_):
+    """全ポジション関数のファクターリターン（関数 × 時点 × ウィンドウ）を.npyで保存する"""
+    columns_ = [x for x in frames_[0].columns if x not in ("start_time", "end_time")]
+    def write(tmp_):
+        np.save(tmp_ + "/start_time.npy", frames_[0]["start_time"].values.view(np.int64))
+        np.save(tmp_ + "/end_time.npy", frames_[0]["end_time"].values.view(np.int64))
+        np.save(tmp_ + "/returns.npy", np.stack([frames_[id_][columns_].values.astype(np.float64) for id_ in range(len(frames_))]))
+        with open(tmp_ + "/meta.json", "w") as f:
+            json.dump({"columns": columns_, "start_time_dtype": str(frames_[0]["start_time"].dtype),
+                       "end_time_dtype": str(frames_[0]["end_time"].dtype)}, f)
+    publishFolder(folder_, write)
+
+def readFactorReturnStore(folder_):
+    with open(folder_ + "/meta.json") as f:
+        meta_ = json.load(f)
+    startTime_ = np.array(np.load(folder_ + "/start_time.npy", mmap_mode="r")).view(meta_["start_time_dtype"])
+    endTime_ = np.array(np.load(folder_ + "/end_time.npy", mmap_mode="r")).view(meta_["end_time_dtype"])
+    returns_ = np.load(folder_ + "/returns.npy", mmap_mode="r")
+    frames_ = {}
+    for id_ in range(returns_.shape[0]):
+        columns_ = {"start_time": startTime_, "end_time": endTime_}
+        for k_, name_ in enumerate(meta_["columns"]):
+            columns_[name_] = np.array(returns_[id_, :, k_])
+        frames_[id_] = pd.DataFrame(columns_)
+    return frames_
+
+def loadFactorReturnAll(family_, fwdRateFactor_, fwdRatePosition_, spotRate_):
+    """
+    全ポジション関数のファクターリターンを返す
+    
+    USE_FACTOR_RETURN_STORE=True の場合、CACHEPATH/factor_returns/ に保存済みならメモリマップで読み込み、
+    なければ計算して保存する。train / testForSim / testForProd の各ジョブで共有される。
+    """
+    prefix_, folder_ = None, None
+    if USE_FACTOR_RETURN_STORE:
+        prefix_, folder_ = factorReturnStoreFolder(family_, fwdRateFactor_, fwdRatePosition_, spotRate_)
+    if folder_ is not None and os.path.exists(folder_ + "/meta.json"):
+        return readFactorReturnStore(folder_)
+    
+    frames_ = makeFactorReturnAll(factorRanking(family_, fwdRateFactor_), FACTOR_FAMILY[family_][1], fwdRatePosition_, spotRate_)
+    if folder_ is not None and len(frames_[0]) > 0:
+        os.makedirs(CACHEPATH + "factor_returns/", exist_ok=True)
+        writeFactorReturnStore(folder_, frames_)
+        # 古い保存データ（入力更新前のもの）を削除
+        for old_ in glob.glob(prefix_ + "*"):
+            if old_ != folder_ and ".tmp" not in old_:
+                shutil.rmtree(old_, ignore_errors=True)
+    return frames_
+
+def cachedFactorReturn(family_, fwdRateFactor_, position_id_, fwdRatePosition_, spotRate_):
+    """
+    全ポジション関数分を一度に計算してメモ化し、position_id_ の結果を返す
+    """
+    key_ = (family_, id(fwdRateFactor_), id(fwdRatePosition_), id(spotRate_))
+    entry_ = _FACTOR_RETURN_CACHE.get(key_)
+    if entry_ is None or entry_[0] is not fwdRateFactor_ or entry_[1] is not fwdRatePosition_ or entry_[2] is not spotRate_:
+        frames_ = loadFactorReturnAll(family_, fwdRateFactor_, fwdRatePosition_, spotRate_)
+        entry_ = (fwdRateFactor_, fwdRatePosition_, spotRate_, frames_)
+        _FACTOR_RETURN_CACHE[key_] = entry_
+    return entry_[3][position_id_].copy()
+
 def makeFactorReturnA(fwdRateFactor_ , factorReturns_, position_id_ , fwdRatePosition_,spotRate_ , swap_df=None):
+    if USE_FAST and len(factorReturns_) == 0 and swap_df is None:
+        return cachedFactorReturn("A", fwdRateFactor_, position_id_, fwdRatePosition_, spotRate_)
+    if USE_FAST:
+        ranking_fast = factorRanking("A", fwdRateFactor_)
     for cprd_ in FACTOR_CALCULATION_PERIOD_A :
-        ranking_  = fwdRateFactor_.set_index("start_time").rolling(cprd_).std().rank(axis = 1, method= "min").T.apply( POSITION_FUNCTIONS_A[position_id_], axis=0).T.dropna()
+        if USE_FAST:
+            ranking_  = positionWeight(ranking_fast[cprd_], POSITION_TABLE_A, position_id_)
+        else:
+            ranking_  = fwdRateFactor_.set_index("start_time").rolling(cprd_).std().rank(axis = 1, method= "min").T.apply( POSITION_FUNCTIONS_A[position_id_], axis=0).T.dropna()
         if USE_FAST:
             factorReturns_ = makeFactorReturn_fast(factorReturns_, ranking_, cprd_, fwdRatePosition_, spotRate_, swap_df=swap_df)
         else:
@@ -630,25 +1726,32 @@ def makeFactorReturnA(fwdRateFactor_ , factorReturns_, position_id_ , fwdRatePos
     return factorReturns_
 
 def makeFactorReturnA_NY17(factorReturns_, position_id_ ):
-    return makeFactorReturnA(FWDRATE_A_NY17 , factorReturns_, position_id_ , FWDRATE_A_NY17, SPOTRATE_A_NY17 )
+    return makeFactorReturnA(getFwdRate("NY17","A") , factorReturns_, position_id_ , getFwdRate("NY17","A"), getSpotRate("NY17","A") )
 
 def makeFactorReturnA_NY17TK20( factorReturns_, position_id_ ):
-    return makeFactorReturnA(FWDRATE_A_NY17TK20 , factorReturns_, position_id_ , FWDRATE_A_NY17TK20, SPOTRATE_A_NY17TK20 )
+    return makeFactorReturnA(getFwdRate("NY17TK20","A") , factorReturns_, position_id_ , getFwdRate("NY17TK20","A"), getSpotRate("NY17TK20","A") )
 
 def makeFactorReturnA_NY17TK1630( factorReturns_, position_id_ ):
-    return makeFactorReturnA(FWDRATE_A_NY17TK1630 , factorReturns_, position_id_ ,FWDRATE_A_NY17TK1630, SPOTRATE_A_NY17TK1630 )
+    return makeFactorReturnA(getFwdRate("NY17TK1630","A") , factorReturns_, position_id_ ,getFwdRate("NY17TK1630","A"), getSpotRate("NY17TK1630","A") )
 
 
 def makeFactorReturnA_TK20(factorReturns_, position_id_ ):
-    return makeFactorReturnA(FWDRATE_A_NY17TK20 , factorReturns_, position_id_ ,FWDRATE_A_TK20, SPOTRATE_A_TK20 )
+    return makeFactorReturnA(getFwdRate("NY17TK20","A") , factorReturns_, position_id_ ,getFwdRate("TK20","A"), getSpotRate("TK20","A") )
 
 def makeFactorReturnA_TK1630(factorReturns_, position_id_ ):
-    return makeFactorReturnA(FWDRATE_A_NY17TK1630 , factorReturns_, position_id_ , FWDRATE_A_TK1630, SPOTRATE_A_TK1630 )
+    return makeFactorReturnA(getFwdRate("NY17TK1630","A") , factorReturns_, position_id_ , getFwdRate("TK1630","A"), getSpotRate("TK1630","A") )
 
 
 def makeFactorReturnB( fwdRateFactor_ ,factorReturns_, position_id_,fwdRatePosition_, spotRate_ , swap_df=None):
+    if USE_FAST and len(factorReturns_) == 0 and swap_df is None:
+        return cachedFactorReturn("B", fwdRateFactor_, position_id_, fwdRatePosition_, spotRate_)
+    if USE_FAST:
+        ranking_fast = factorRanking("B", fwdRateFactor_)
     for cprd_ in FACTOR_CALCULATION_PERIOD_B :
-        ranking_  = (fwdRateFactor_ .set_index(["start_time"]) - fwdRateFactor_.set_index(["start_time"]).rolling(cprd_).mean() ).rank(axis = 1, method= "min").T.apply( POSITION_FUNCTIONS_B[position_id_], axis=0).T.dropna()
+        if USE_FAST:
+            ranking_  = positionWeight(ranking_fast[cprd_], POSITION_TABLE_B, position_id_)
+        else:
+            ranking_  = (fwdRateFactor_ .set_index(["start_time"]) - fwdRateFactor_.set_index(["start_time"]).rolling(cprd_).mean() ).rank(axis = 1, method= "min").T.apply( POSITION_FUNCTIONS_B[position_id_], axis=0).T.dropna()
         if USE_FAST:
             factorReturns_ = makeFactorReturn_fast(factorReturns_, ranking_, cprd_, fwdRatePosition_, spotRate_, swap_df=swap_df)
         else:
@@ -656,24 +1759,29 @@ def makeFactorReturnB( fwdRateFactor_ ,factorReturns_, position_id_,fwdRatePosit
     return factorReturns_
 
 def makeFactorReturnB_NY17( factorReturns_, position_id_ ):
-    return makeFactorReturnB(FWDRATE_B_NY17 , factorReturns_, position_id_ , FWDRATE_B_NY17, SPOTRATE_B_NY17 )
+    return makeFactorReturnB(getFwdRate("NY17","B") , factorReturns_, position_id_ , getFwdRate("NY17","B"), getSpotRate("NY17","B") )
 
 def makeFactorReturnB_NY17TK20( factorReturns_, position_id_ ):
-    return makeFactorReturnB(FWDRATE_B_NY17TK20 , factorReturns_, position_id_ ,FWDRATE_B_NY17TK20, SPOTRATE_B_NY17TK20 )
+    return makeFactorReturnB(getFwdRate("NY17TK20","B") , factorReturns_, position_id_ ,getFwdRate("NY17TK20","B"), getSpotRate("NY17TK20","B") )
 
 def makeFactorReturnB_NY17TK1630( factorReturns_, position_id_ ):
-    return makeFactorReturnB(FWDRATE_B_NY17TK1630 , factorReturns_, position_id_ ,FWDRATE_B_NY17TK1630, SPOTRATE_B_NY17TK1630 )
+    return makeFactorReturnB(getFwdRate("NY17TK1630","B") , factorReturns_, position_id_ ,getFwdRate("NY17TK1630","B"), getSpotRate("NY17TK1630","B") )
 
 
 def makeFactorReturnB_TK20( factorReturns_, position_id_ ):
-    return makeFactorReturnB(FWDRATE_B_NY17TK20 , factorReturns_, position_id_ , FWDRATE_B_TK20, SPOTRATE_B_TK20 )
+    return makeFactorReturnB(getFwdRate("NY17TK20","B") , factorReturns_, position_id_ , getFwdRate("TK20","B"), getSpotRate("TK20","B") )
 
 def makeFactorReturnB_TK1630( factorReturns_, position_id_ ):
-    return makeFactorReturnB(FWDRATE_B_NY17TK1630 , factorReturns_, position_id_ ,FWDRATE_B_TK1630, SPOTRATE_B_TK1630 )
+    return makeFactorReturnB(getFwdRate("NY17TK1630","B") , factorReturns_, position_id_ ,getFwdRate("TK1630","B"), getSpotRate("TK1630","B") )
 
 def makeFactorReturnC(fwdRateFactor_, factorReturns_, position_id_ ,fwdRatePosition_, spotRate_ , swap_df=None):
+    if USE_FAST and len(factorReturns_) == 0 and swap_df is None:
+        return cachedFactorReturn("C", fwdRateFactor_, position_id_, fwdRatePosition_, spotRate_)
     for cprd_ in FACTOR_CALCULATION_PERIOD_C :
-        ranking_  = fwdRateFactor_.set_index(["start_time"]).pct_change(cprd_).rank(axis = 1, method= "min").T.apply( POSITION_FUNCTIONS_C[position_id_], axis=0).T.dropna()
+        if USE_FAST:
+            ranking_  = positionWeight(factorRanking("C", fwdRateFactor_)[cprd_], POSITION_TABLE_C, position_id_)
+        else:
+            ranking_  = fwdRateFactor_.set_index(["start_time"]).pct_change(cprd_).rank(axis = 1, method= "min").T.apply( POSITION_FUNCTIONS_C[position_id_], axis=0).T.dropna()
         if USE_FAST:
             factorReturns_ = makeFactorReturn_fast(factorReturns_, ranking_, cprd_, fwdRatePosition_, spotRate_, swap_df=swap_df)
         else:
@@ -681,23 +1789,26 @@ def makeFactorReturnC(fwdRateFactor_, factorReturns_, position_id_ ,fwdRatePosit
     return factorReturns_
 
 def makeFactorReturnC_NY17( factorReturns_, position_id_ ):
-    return makeFactorReturnC(FWDRATE_C_NY17 , factorReturns_, position_id_ , FWDRATE_C_NY17,SPOTRATE_C_NY17 )
+    return makeFactorReturnC(getFwdRate("NY17","C") , factorReturns_, position_id_ , getFwdRate("NY17","C"),getSpotRate("NY17","C") )
 
 def makeFactorReturnC_NY17TK20( factorReturns_, position_id_ ):
-    return makeFactorReturnC(FWDRATE_C_NY17TK20 , factorReturns_, position_id_ , FWDRATE_C_NY17TK20,SPOTRATE_C_NY17TK20 )
+    return makeFactorReturnC(getFwdRate("NY17TK20","C") , factorReturns_, position_id_ , getFwdRate("NY17TK20","C"),getSpotRate("NY17TK20","C") )
 
 def makeFactorReturnC_NY17TK1630( factorReturns_, position_id_ ):
-    return makeFactorReturnC(FWDRATE_C_NY17TK1630 , factorReturns_, position_id_ ,FWDRATE_C_NY17TK1630, SPOTRATE_C_NY17TK1630 )
+    return makeFactorReturnC(getFwdRate("NY17TK1630","C") , factorReturns_, position_id_ ,getFwdRate("NY17TK1630","C"), getSpotRate("NY17TK1630","C") )
 
 def makeFactorReturnC_TK20( factorReturns_, position_id_ ):
-    return makeFactorReturnC(FWDRATE_C_NY17TK20 , factorReturns_, position_id_ , FWDRATE_C_TK20,SPOTRATE_C_TK20 )
+    return makeFactorReturnC(getFwdRate("NY17TK20","C") , factorReturns_, position_id_ , getFwdRate("TK20","C"),getSpotRate("TK20","C") )
 
 def makeFactorReturnC_TK1630( factorReturns_, position_id_ ):
-    return makeFactorReturnC(FWDRATE_C_NY17TK1630 , factorReturns_, position_id_ ,FWDRATE_C_TK1630, SPOTRATE_C_TK1630 )
+    return makeFactorReturnC(getFwdRate("NY17TK1630","C") , factorReturns_, position_id_ ,getFwdRate("TK1630","C"), getSpotRate("TK1630","C") )
 
 
 
 def makeWeightA(fwdRate_,positionId1_,positionId2_):
+    if USE_FAST:
+        return cachedWeight("A", fwdRate_, positionId1_, positionId2_)
+
     if positionId1_ == positionId2_:
         weight_ = {}
         for cprd_ in FACTOR_CALCULATION_PERIOD_A :
@@ -711,16 +1822,19 @@ def makeWeightA(fwdRate_,positionId1_,positionId2_):
     return weight_    
 
 def makeWeightA_NY17(positionId1_,positionId2_):
-    return makeWeightA(FWDRATE_A_NY17,positionId1_,positionId2_)
+    return makeWeightA(getFwdRate("NY17","A"),positionId1_,positionId2_)
 
 def makeWeightA_TK20(positionId1_,positionId2_):
-    return makeWeightA(FWDRATE_A_NY17TK20,positionId1_,positionId2_)
+    return makeWeightA(getFwdRate("NY17TK20","A"),positionId1_,positionId2_)
 
 def makeWeightA_TK1630(positionId1_,positionId2_):
-    return makeWeightA(FWDRATE_A_NY17TK1630,positionId1_,positionId2_)
+    return makeWeightA(getFwdRate("NY17TK1630","A"),positionId1_,positionId2_)
 
 
 def makeWeightB(fwdRate_, positionId1_,positionId2_):
+    if USE_FAST:
+        return cachedWeight("B", fwdRate_, positionId1_, positionId2_)
+
     if positionId1_ == positionId2_:
         weight_ = {}
         for cprd_ in FACTOR_CALCULATION_PERIOD_B :
@@ -734,16 +1848,19 @@ def makeWeightB(fwdRate_, positionId1_,positionId2_):
     return weight_    
 
 def makeWeightB_NY17(positionId1_,positionId2_):
-    return makeWeightB(FWDRATE_B_NY17,positionId1_,positionId2_)
+    return makeWeightB(getFwdRate("NY17","B"),positionId1_,positionId2_)
 
 def makeWeightB_TK20(positionId1_,positionId2_):
-    return makeWeightB(FWDRATE_B_NY17TK20,positionId1_,positionId2_)
+    return makeWeightB(getFwdRate("NY17TK20","B"),positionId1_,positionId2_)
 
 def makeWeightB_TK1630(positionId1_,positionId2_):
-    return makeWeightB(FWDRATE_B_NY17TK1630,positionId1_,positionId2_)
+    return makeWeightB(getFwdRate("NY17TK1630","B"),positionId1_,positionId2_)
 
 
 def makeWeightC(fwdRate_, positionId1_,positionId2_):
+    if USE_FAST:
+        return cachedWeight("C", fwdRate_, positionId1_, positionId2_)
+
     if positionId1_ == positionId2_:
         weight_ = {}
         for cprd_ in FACTOR_CALCULATION_PERIOD_C :
@@ -757,25 +1874,71 @@ def makeWeightC(fwdRate_, positionId1_,positionId2_):
     return weight_    
 
 def makeWeightC_NY17(positionId1_,positionId2_):
-    return makeWeightC(FWDRATE_C_NY17,positionId1_,positionId2_)
+    return makeWeightC(getFwdRate("NY17","C"),positionId1_,positionId2_)
 
 def makeWeightC_TK20(positionId1_,positionId2_):
-    return makeWeightC(FWDRATE_C_NY17TK20,positionId1_,positionId2_)
+    return makeWeightC(getFwdRate("NY17TK20","C"),positionId1_,positionId2_)
 
 def makeWeightC_TK1630(positionId1_,positionId2_):
-    return makeWeightC(FWDRATE_C_NY17TK1630,positionId1_,positionId2_)
+    return makeWeightC(getFwdRate("NY17TK1630","C"),positionId1_,positionId2_)
 
 
 
 
 
 
-def simulateIndividualStrategyForSim(factorReturns_, in_, out_, n_ ,weight_,positionId1_ , positionId2_,  fileName_ ,factorReturns2_=None ):
-    if factorReturns2_ is None:
-        factorReturns2_ = factorReturns_
-        
-    rslt_ = pd.DataFrame()
-    retWeight_ = pd.DataFrame()
+def topSelection(values_, numberOfParameters_):
+    """
+    高速化版: 各行の上位n個に等ウェイトを置く配分を、採用数ごとに一括で作る
+    
+    round(10) → rank(ascending=False, method="min") → my_select と同じ結果になる。
+    min順位が n 以下 ⇔ 値が行内で n 番目に大きい値以上、なので np.partition で全ての n の閾値を一度に求める。
+    
+    Args:
+        values_: 時点 × ウィンドウの2次元配列
+        numberOfParameters_: 採用数のリスト
+    
+    Returns:
+        {n_: 配分の2次元配列}（NaN を含む行は NaN）
+    """
+    values_ = np.round(np.asarray(values_, dtype = np.float64), 10)
+    valid_ = ~np.isnan(values_).any(axis = 1)
+    kth_ = sorted({min(n_, values_.shape[1]) - 1 for n_ in numberOfParameters_})
+    sorted_ = -np.partition(-values_, kth_, axis = 1) if values_.shape[1] > 0 else values_
+    selection_ = {}
+    for n_ in numberOfParameters_:
+        threshold_ = sorted_[:, min(n_, values_.shape[1]) - 1]
+        selected_ = (values_ >= threshold_[:, np.newaxis]).astype(np.float64)
+        count_ = selected_.sum(axis = 1)
+        selected_ = np.where(count_[:, np.newaxis] > 0, selected_ / np.maximum(count_, 1)[:, np.newaxis], selected_)
+        selected_[~valid_] = np.nan
+        selection_[n_] = selected_
+    return selection_
+
+def makeSelection_fast(factorReturns_, in_, out_, n_):
+    """
+    高速化版: makeSelection の順位付けと my_select を topSelection に置き換えたもの
+    """
+    numeric_cols = factorReturns_.select_dtypes(include=[np.number]).columns.tolist()
+    my_sr_ = factorReturns_.set_index("start_time")[numeric_cols].rolling(in_-1 ).mean().shift(2).dropna()[::out_]
+    position_ = pd.DataFrame(topSelection(my_sr_.values, [n_])[n_], index = my_sr_.index, columns = numeric_cols)
+    return position_.dropna().sort_index()
+
+def makeSelection(factorReturns_, in_, out_, n_):
+    """
+    リバランス日ごとの採用ウィンドウとその配分（上位n_個に等ウェイト）を作る
+    
+    Args:
+        factorReturns_: start_time列と各ウィンドウ列を持つファクターリターンDataFrame
+        in_: 参照期間
+        out_: リバランス間隔
+        n_: 採用数
+    
+    Returns:
+        position_: リバランス日をindex、ウィンドウ列を columns に持つ配分DataFrame
+    """
+    if USE_FAST:
+        return makeSelection_fast(factorReturns_, in_, out_, n_)
     def my_select(vec_, n_ ):
         vec_[ vec_ <= n_ ]  = 1
         vec_[ vec_ >= (n_+1) ]  = 0
@@ -783,8 +1946,6 @@ def simulateIndividualStrategyForSim(factorReturns_, in_, out_, n_ ,weight_,posi
         if sum_ > 0 :
             vec_ = vec_ /sum(vec_)
         return vec_
-    def vecProduct( vec1_ , vec2_):
-        return vec1_ * vec2_
     
     #my_factorReturns_ = factorReturns_ >> mutate(end_time=lead(X.start_time, i=1)) >> select(X.start_time, X.end_time, everything())
     my_factorReturns_ = factorReturns_.copy()
@@ -812,6 +1973,20 @@ def simulateIndividualStrategyForSim(factorReturns_, in_, out_, n_ ,weight_,posi
     position_ =   ref_mean_vals[::out_].set_index("start_time")[rank_cols].round(10).rank(
     axis = 1 , ascending = False, method ="min" ).apply(
     my_select, n_ = n_,  axis=1).dropna().sort_index()
+    return position_
+
+def simulateIndividualStrategyForSim(factorReturns_, in_, out_, n_ ,weight_,positionId1_ , positionId2_,  fileName_ ,factorReturns2_=None ):
+    if USE_FAST:
+        return simulateIndividualStrategyForSim_fast(factorReturns_, in_, out_, n_ ,weight_,positionId1_ , positionId2_,  fileName_ ,factorReturns2_)
+    if factorReturns2_ is None:
+        factorReturns2_ = factorReturns_
+        
+    rslt_ = pd.DataFrame()
+    retWeight_ = pd.DataFrame()
+    def vecProduct( vec1_ , vec2_):
+        return vec1_ * vec2_
+    
+    position_ = makeSelection(factorReturns_, in_, out_, n_)
     
     if PYTHONFILENAME == "train.py":
         allocation_ = pd.merge(factorReturns2_[["start_time"]],position_, on ="start_time", how ="left"  ).fillna(method='ffill').dropna()
@@ -841,6 +2016,8 @@ def simulateIndividualStrategyForSim(factorReturns_, in_, out_, n_ ,weight_,posi
             retWeight_  = pd.concat([retWeight_, addonWeight_])
     
         
+    if len(position_) == 0:
+        raise IndexError("リバランス日の配分がありません（参照期間 %d, リバランス間隔 %d）" % (in_, out_))
     outofSamplePeriodFrom_ = position_.index[ len(position_)-1 ]
     tmp_ =  factorReturns2_[  ( factorReturns2_["start_time"] >=outofSamplePeriodFrom_ ) ].set_index("start_time") 
     vec_ = list( position_.loc[outofSamplePeriodFrom_].reset_index(drop = True) ) 
@@ -867,49 +2044,215 @@ def simulateIndividualStrategyForSim(factorReturns_, in_, out_, n_ ,weight_,posi
 
 
 
+def rebalanceSegment(rebalance_, startTime_):
+    """
+    各時点が属するリバランス区間を求める
+    
+    Returns:
+        rows_: 最初のリバランス日以降の行番号（区間順）
+        segment_: rows_ の各行の区間番号（rebalance_ の位置）
+    """
+    segment_ = np.searchsorted(rebalance_, startTime_, side = "right") - 1
+    rows_ = np.flatnonzero(segment_ >= 0)
+    rows_ = rows_[np.argsort(segment_[rows_], kind = "stable")]
+    return rows_, segment_[rows_]
+
+def strategyReturns(tmp_, rows_, allocation_):
+    """
+    各ウィンドウの寄与（リターン × 配分）と total 列を持つDataFrameを作る
+    
+    既存版（行ごとのapply結果の連結）と同じく列方向に連続な配置にして、total の加算順序を揃える。
+    """
+    product_ = np.ascontiguousarray((tmp_.values[rows_] * allocation_).T)
+    rslt_ = pd.DataFrame(product_.T, index = tmp_.index[rows_], columns = tmp_.columns)
+    rslt_["total"]  = rslt_.sum(axis= 1)
+    return rslt_
+
+def strategyTotal(values_, rows_, allocation_):
+    """
+    strategyReturns の total 列だけを、DataFrameを作らずに同じ配置・同じ加算順序で求める
+    
+    pandas の行方向の合計（NaN を0にしてから列方向に連続な配列を numpy で合計）と同じ計算をする。
+    """
+    product_ = np.ascontiguousarray((values_[rows_] * allocation_).T).T
+    mask_ = np.isnan(product_)
+    if mask_.any():
+        product_ = product_.copy()
+        np.putmask(product_, mask_, 0)
+    return product_.sum(axis = 1)
+
+def simulateGrid(factorReturns_, factorReturns2_=None, refPeriodWidth_=None, tradePeriodWidth_=None, numberOfParameters_=None, from_=None):
+    """
+    高速化版: ハイパーパラメータ格子（参照期間 × リバランス間隔 × 採用数）の戦略リターンを一括計算する
+    
+    ローリング平均は参照期間ごとに1回計算し、採用数ごとの配分は (参照期間, リバランス間隔) ごとに
+    topSelection で一括して作る。各格子点の値は simulateIndividualStrategyForSim の total 列と同一。
+    
+    Args:
+        factorReturns_: 選択に使うファクターリターン（start_time列と各ウィンドウ列）
+        factorReturns2_: 運用するファクターリターン（省略時は factorReturns_）
+        refPeriodWidth_, tradePeriodWidth_, numberOfParameters_: 格子（省略時は REF_PERIOD_WIDTH など）
+        from_: 指定した場合はこの時点以降だけ計算する（配分は全期間のデータから決まるので各時点の値は同じ）
+    
+    Returns:
+        start_timeをindex、"in_out_n" を列に持つDataFrame（最初のリバランス日より前と from_ より前は NaN）
+    """
+    if factorReturns2_ is None:
+        factorReturns2_ = factorReturns_
+    refPeriodWidth_ = REF_PERIOD_WIDTH if refPeriodWidth_ is None else refPeriodWidth_
+    tradePeriodWidth_ = TRADE_PERIOD_WIDTH if tradePeriodWidth_ is None else tradePeriodWidth_
+    numberOfParameters_ = NUMBER_OF_PARAMETERS if numberOfParameters_ is None else numberOfParameters_
+    
+    numeric_cols = factorReturns_.select_dtypes(include=[np.number]).columns.tolist()
+    frame_ = factorReturns_.set_index("start_time")[numeric_cols]
+    tmp_ = factorReturns2_.set_index("start_time")
+    values_ = tmp_.values
+    
+    grid_ = {}
+    for in_ in refPeriodWidth_:
+        my_sr_ = frame_.rolling(in_-1 ).mean().shift(2).dropna()
+        for out_ in tradePeriodWidth_:
+            ref_ = my_sr_[::out_]
+            selections_ = topSelection(ref_.values, numberOfParameters_)
+            valid_ = ~np.isnan(selections_[numberOfParameters_[0]]).any(axis = 1)
+            order_ = np.argsort(ref_.index.values[valid_], kind = "stable")
+            rows_, segment_ = rebalanceSegment(ref_.index.values[valid_][order_], tmp_.index.values)
+            if from_ is not None:
+                keep_ = tmp_.index.values[rows_] >= np.datetime64(from_)
+                rows_, segment_ = rows_[keep_], segment_[keep_]
+            for n_ in numberOfParameters_:
+                selection_ = selections_[n_][valid_][order_]
+                total_ = np.full(len(tmp_), np.nan)
+                total_[rows_] = strategyTotal(values_, rows_, selection_[segment_])
+                grid_[str(in_)+"_"+str(out_)+"_"+str(n_)] = total_
+    return pd.DataFrame(grid_, index = tmp_.index)
+
+def simulateYearStatistics(values_, year_):
+    """
+    高速化版: 格子の各列について、全格子点に値がある時点の end_time の年ごとの統計（yearStatistics）を求める
+    
+    既存版は simulationTo_ ごとに全格子点の結果を start_time で inner join してから平均を取るので、
+    平均を取る時点は全格子点に値がある時点の共通部分になる。共通部分は年によらないので、
+    年ごとの和と個数を一度だけ求め、累積和から各 simulationTo_ の平均を作る（yearMeans）。
+    （共通部分が空になる年だけは、既存版と同じく格子点の順に取り直した時点で平均を取る（simulateFallbackMean））
+    
+    Args:
+        values_, year_: simulateYearValues の結果
+    
+    Returns:
+        years_: 共通時点がある年
+        count_, stats_: yearStatistics の結果
+    """
+    years_ = np.unique(year_[~np.isnan(values_).any(axis = 1)])
+    count_, stats_ = yearStatistics(values_, year_, years_)
+    return years_, count_, stats_
+
+def simulateYearValues(grid_, endTime_):
+    """
+    格子の値を end_time のある時点に揃える
+    
+    Returns:
+        values_: 時点 × 格子点の配列
+        year_: 各時点の end_time の年
+    """
+    endTime_ = pd.merge(pd.DataFrame({"start_time": grid_.index}), endTime_[["start_time","end_time"]], on ="start_time", how ="inner" )
+    values_ = grid_.values[grid_.index.get_indexer(endTime_["start_time"])]
+    return values_, endTime_["end_time"].dt.year.values
+
+def simulateFallbackMean(values_, year_, simulationTo_):
+    """
+    共通時点がない年の平均（既存版と同じく、結合結果が空になったら次の格子点から取り直した時点で平均を取る）
+    """
+    rows_ = None
+    for g_ in range(values_.shape[1]):
+        addon_ = ~np.isnan(values_[:, g_]) & (year_ <= simulationTo_)
+        rows_ = addon_ if rows_ is None or not rows_.any() else rows_ & addon_
+    if rows_ is not None and rows_.any():
+        return values_[rows_].mean(axis = 0)
+    return np.full(values_.shape[1], np.nan)
+
+def yearMeans(years_, sum_, count_, fallback_, simulationPeriod_, columns_):
+    """
+    年ごとの和と個数の累積から各 simulationTo_ の平均を作る（共通時点がない年は fallback_ の値）
+    
+    既存版は simulationTo_ ごとに全時点の Series.mean()（pairwise 加算）を取るので、加算順序の違いで
+    下位数ビットの差が出る（平均の相対誤差は実測で 1e-15 程度）。年ごとの和を使い回せるので、
+    最終年が進んでも新しい年の和だけを求めればよい。個数が0の年は累積に加えない。
+    """
+    years_ = np.asarray(years_)
+    count_ = np.asarray(count_, dtype = np.float64)
+    used_ = count_ > 0
+    years_ = years_[used_]
+    sum_ = np.cumsum(np.asarray(sum_)[used_], axis = 0)
+    count_ = np.cumsum(count_[used_])
+    means_ = np.full((len(simulationPeriod_), len(columns_)), np.nan)
+    for j_, simulationTo_ in enumerate(simulationPeriod_):
+        k_ = np.searchsorted(years_, simulationTo_, side = "right")
+        if k_ > 0:
+            means_[j_] = sum_[k_-1] / count_[k_-1]
+        elif fallback_.get(simulationTo_) is not None:
+            means_[j_] = fallback_[simulationTo_]
+    return pd.DataFrame(means_, index = list(simulationPeriod_), columns = columns_)
+
+def simulateIndividualStrategyForSim_fast(factorReturns_, in_, out_, n_ ,weight_,positionId1_ , positionId2_,  fileName_ ,factorReturns2_=None ):
+    """
+    高速化版: リバランスごとのループをなくしたウォークフォワード
+    
+    各時点にリバランス区間の番号（searchsorted）を振り、配分を区間番号で各時点に展開して、
+    リターンは1回の要素積で求める。ウェイトは採用されたウィンドウごとに1回ずつ加算する
+    （既存版と同じく weight_ のdtype（float32）で、同じ順序で加算するので結果は既存版と一致する）。
+    
+    Returns:
+        rslt_: 各ウィンドウの寄与と total 列を持つDataFrame
+        retWeight_: 通貨ごとのウェイトDataFrame
+    """
+    if factorReturns2_ is None:
+        factorReturns2_ = factorReturns_
+    
+    position_ = makeSelection(factorReturns_, in_, out_, n_)
+    # 既存版と同じく、配分が1つもない場合は IndexError
+    if len(position_) == 0:
+        raise IndexError("リバランス日の配分がありません（参照期間 %d, リバランス間隔 %d）" % (in_, out_))
+    rebalance_ = position_.index.values
+    selection_ = position_.values
+    
+    # リターン: 最初のリバランス日以降の各時点 × その区間の配分
+    tmp_ = factorReturns2_.set_index("start_time")
+    rows_, segment_ = rebalanceSegment(rebalance_, tmp_.index.values)
+    rslt_ = strategyReturns(tmp_, rows_, selection_[segment_])
+    
+    # ウェイト: 区間ごとに採用ウィンドウのウェイト × 配分を加算（採用ウィンドウのいずれかにある時点のみ）
+    selected_ = [i_ for i_ in range(selection_.shape[1]) if (selection_[:, i_] > 0).any()]
+    frames_ = [weight_[position_.columns[i_]] for i_ in selected_]
+    index_ = frames_[0].index
+    for frame_ in frames_[1:]:
+        index_ = index_.union(frame_.index)
+    index_ = index_[index_ >= rebalance_[0]]
+    segmentW_ = np.searchsorted(rebalance_, index_.values, side = "right") - 1
+    dtype_ = np.result_type(*[frame_.values.dtype for frame_ in frames_])
+    weight_array = np.zeros((len(index_), frames_[0].shape[1]), dtype = dtype_)
+    keep_ = np.zeros(len(index_), dtype = bool)
+    for i_, frame_ in zip(selected_, frames_):
+        v_ = selection_[segmentW_, i_]
+        sel_ = v_ > 0
+        aligned_ = frame_.reindex(index_).values
+        weight_array = np.where(sel_[:, np.newaxis], weight_array + aligned_ * v_.astype(dtype_)[:, np.newaxis], weight_array)
+        keep_ |= sel_ & (frame_.index.get_indexer(index_) >= 0)
+    retWeight_ = pd.DataFrame(weight_array[keep_], index = index_[keep_], columns = frames_[0].columns)
+    
+    return rslt_, retWeight_
+
+
 def simulateIndividualStrategyForProd(factorReturns_, in_, out_, n_ ,weight_,positionId1_ , positionId2_,  fileName_ , datePre_,factorReturns2_=None ):
     if factorReturns2_ is None:
         factorReturns2_ = factorReturns_
         
     rslt_ = pd.DataFrame()
     retWeight_ = pd.DataFrame()
-    def my_select(vec_, n_ ):
-        vec_[ vec_ <= n_ ]  = 1
-        vec_[ vec_ >= (n_+1) ]  = 0
-        sum_ = sum(vec_)
-        if sum_ > 0 :
-            vec_ = vec_ /sum(vec_)
-        return vec_
     def vecProduct( vec1_ , vec2_):
         return vec1_ * vec2_
     
-    #my_factorReturns_ = factorReturns_ >> mutate(end_time=lead(X.start_time, i=1)) >> select(X.start_time, X.end_time, everything())
-    my_factorReturns_ = factorReturns_.copy()
-    my_factorReturns_["end_time"] =my_factorReturns_["start_time"].shift(-1)
-        
-    #date_df = my_factorReturns_[["start_time"]] >> mutate(ref_last_start_time = lag(X.start_time, i=2), ref_last_end_time = lag(X.start_time, i=1)) >> mutate(trade_fst_start_time = X.start_time)
-    date_df = my_factorReturns_[["start_time"]].copy()
-    date_df["ref_last_start_time"] = my_factorReturns_["start_time"].shift(2)
-    date_df["ref_last_end_time"] = my_factorReturns_["start_time"].shift(1)
-    date_df["trade_fst_start_time"] = my_factorReturns_["start_time"]
-
-    # rollingする前に数値列のみを選択（datetime列を除外）
-    numeric_cols = my_factorReturns_.select_dtypes(include=[np.number]).columns.tolist()
-    if 'start_time' in numeric_cols:
-        numeric_cols.remove('start_time')
-    my_sr_ = my_factorReturns_.set_index("start_time")[numeric_cols].rolling(in_-1 ).mean().shift(2).dropna()
-    ref_mean_vals= my_sr_.reset_index().copy()
-    ref_mean_vals = pd.merge(ref_mean_vals, date_df, on = "start_time",how ="left")
-    #ref_mean_vals= my_sr_.reset_index() >> mutate(start_time = my_sr_.index) >> left_join(date_df, by = "start_time") >> select(X.start_time, X.ref_last_start_time, X.ref_last_end_time, X.trade_fst_start_time, everything())
-    
-    # rank()を実行する前に数値列のみを選択（datetime列を除外）
-    rank_cols = ref_mean_vals.select_dtypes(include=[np.number]).columns.tolist()
-    if 'start_time' in rank_cols:
-        rank_cols.remove('start_time')
-    position_ =   ref_mean_vals[::out_].set_index("start_time")[rank_cols].round(10).rank(
-    axis = 1 , ascending = False, method ="min" ).apply(
-    my_select, n_ = n_,  axis=1).dropna().sort_index()
-    
+    position_ = makeSelection(factorReturns_, in_, out_, n_)
     
     from_ = np.count_nonzero(position_.index  < datePre_)
     for row_ in range(from_, len(position_) ):
@@ -934,6 +2277,8 @@ def simulateIndividualStrategyForProd(factorReturns_, in_, out_, n_ ,weight_,pos
             retWeight_  = pd.concat([retWeight_, addonWeight_])
     
         
+    if len(position_) == 0:
+        raise IndexError("リバランス日の配分がありません（参照期間 %d, リバランス間隔 %d）" % (in_, out_))
     outofSamplePeriodFrom_ = position_.index[ len(position_)-1 ]
     tmp_ =  factorReturns2_[  ( factorReturns2_["start_time"] >=outofSamplePeriodFrom_ ) ].set_index("start_time") 
     vec_ = list( position_.loc[outofSamplePeriodFrom_].reset_index(drop = True) ) 
@@ -960,6 +2305,8 @@ def simulateIndividualStrategyForProd(factorReturns_, in_, out_, n_ ,weight_,pos
 
 
 def simulate(factorReturns_, simulationPeriod_,endTime_,weight_,positionId1_ , positionId2_,  fileName_  ):
+    if USE_FAST:
+        return simulate_fast(factorReturns_, simulationPeriod_,endTime_,weight_,positionId1_ , positionId2_,  fileName_  )
     output_ = pd.DataFrame()
     ret_ = {}
     for simulationTo_ in simulationPeriod_:
@@ -996,6 +2343,81 @@ def simulate(factorReturns_, simulationPeriod_,endTime_,weight_,positionId1_ , p
     return output_
 
 
+def simulate_fast(factorReturns_, simulationPeriod_,endTime_,weight_,positionId1_ , positionId2_,  fileName_  ):
+    """
+    高速化版: 格子一括計算（simulateGrid）と年ごとの統計（simulateYearStatistics）で simulate と同じ表を作る
+    
+    ウェイトは使わないので計算しない。SIMULATION_RANKING が "mean" 以外の場合は同じ年ごとの統計から
+    sr, sortino 列も加える。
+    """
+    grid_ = simulateGrid(factorReturns_.drop("end_time",axis=1))
+    values_, year_ = simulateYearValues(grid_, endTime_)
+    years_, count_, stats_ = simulateYearStatistics(values_, year_)
+    fallback_ = {simulationTo_: simulateFallbackMean(values_, year_, simulationTo_) for simulationTo_ in simulationPeriod_ if not (years_ <= simulationTo_).any()}
+    means_ = yearMeans(years_, stats_[:, 0], count_, fallback_, simulationPeriod_, grid_.columns)
+    rankings_ = None if SIMULATION_RANKING == "mean" else expandingStatistics(years_, count_, stats_, simulationPeriod_, grid_.columns)
+    return simulationOutput(means_, simulationPeriod_, positionId1_, positionId2_, rankings_)
+
+def gridColumns():
+    """simulateGrid の列名（"in_out_n"）"""
+    return [str(in_)+"_"+str(out_)+"_"+str(n_) for in_ in REF_PERIOD_WIDTH for out_ in TRADE_PERIOD_WIDTH for n_ in NUMBER_OF_PARAMETERS]
+
+def simulationOutput(means_, simulationPeriod_, positionId1_, positionId2_, rankings_=None):
+    """
+    simulationTo_ × 格子点の平均から simulate と同じ形式の表を作る（行は simulationTo_ ごとに格子点の順）
+    
+    rankings_（expandingStatistics の結果）を渡した場合は sr, sortino 列を最後に加える。
+    """
+    grid_ = np.array([[in_, out_, n_] for in_ in REF_PERIOD_WIDTH for out_ in TRADE_PERIOD_WIDTH for n_ in NUMBER_OF_PARAMETERS], dtype = np.int64)
+    years_ = np.array(list(simulationPeriod_), dtype = np.int64)
+    output_ = pd.DataFrame({"ref_period_width": np.tile(grid_[:, 0], len(years_)),
+                            "trade_period_width": np.tile(grid_[:, 1], len(years_)),
+                            "number_of_parameters": np.tile(grid_[:, 2], len(years_)),
+                            "mean": means_.loc[list(simulationPeriod_), gridColumns()].values.ravel(),
+                            "simulation_period_to": np.repeat(years_, len(grid_))})
+    output_["position_id_1"] = positionId1_
+    output_["position_id_2"] = positionId2_
+    for name_, ranking_ in (rankings_ or {}).items():
+        output_[name_] = ranking_.loc[list(simulationPeriod_), gridColumns()].values.ravel()
+    return output_
+
+def selectHyperparameters(selected_, simulationResult_, simulationPeriod_):
+    """
+    高速化版: simulate の結果から、simulationTo_ ごとに SIMULATION_RANKING の上位 NUMBER_OF_HYPERPARAMETER 個のうち
+    mean が THRESHOLD を超える行を残す
+    
+    並びは既存版の sort_values("mean", ascending=False, kind="mergesort") と同じ（同値は元の順、欠損は最後）。
+    残した行は列ごとの配列として selected_[simulationTo_] に追加する（DataFrameの連結はしない）。
+    
+    Args:
+        selected_: simulationTo_ をキー、列配列のdictのリストを値に持つdict（更新される）
+        simulationResult_: simulate の結果
+        simulationPeriod_: simulationTo_ のリスト
+    """
+    columns_ = {column_: simulationResult_[column_].values for column_ in simulationResult_.columns}
+    mean_ = columns_["mean"]
+    ranking_ = columns_[SIMULATION_RANKING]
+    year_ = columns_["simulation_period_to"]
+    for simulationTo_ in simulationPeriod_:
+        rows_ = np.flatnonzero(year_ == simulationTo_)
+        rows_ = rows_[np.argsort(-ranking_[rows_], kind = "stable")][:NUMBER_OF_HYPERPARAMETER]
+        rows_ = rows_[mean_[rows_] > THRESHOLD]
+        if len(rows_) > 0:
+            selected_[simulationTo_].append({column_: values_[rows_] for column_, values_ in columns_.items()})
+
+def selectedFrame(selected_):
+    """
+    高速化版: selectHyperparameters で残した行を1つのDataFrameにする（既存版の train_result_*.csv と同じ表）
+    """
+    chunks_ = [chunk_ for simulationTo_ in selected_ for chunk_ in selected_[simulationTo_]]
+    if len(chunks_) == 0:
+        return pd.DataFrame()
+    ret_ = pd.DataFrame({column_: np.concatenate([chunk_[column_] for chunk_ in chunks_]) for column_ in chunks_[0]})
+    for column_ in ["trade_period_width", "ref_period_width", "number_of_parameters"]:
+        ret_[column_] = ret_[column_].astype(int)
+    return ret_
+
+
 def train(  calculateFactorReturn , simulationPeriod_ , calculateWeight,positionFunctions_ ,  fileName_ ):
     
     endTime_ = getEndTime(calculateFactorReturn)
@@ -1007,18 +2429,21 @@ def train(  calculateFactorReturn , simulationPeriod_ , calculateWeight,position
                     factorReturnsDict_[positionId1_] = calculateFactorReturn(pd.DataFrame(), positionId1_)
                     
     strategyInfo_ = {}
+    selected_ = {}
     for simulationTo_ in simulationPeriod_:
         strategyInfo_[simulationTo_] = pd.DataFrame()
+        selected_[simulationTo_] = []
     
     for positionId1_ ,positionId2_  in itertools.combinations_with_replacement(range(0,len(positionFunctions_) ) ,2):
         
-        factorReturns_ = factorReturnsDict_[positionId1_]
-        if positionId1_ != positionId2_: 
-            factorReturns_ = pd.merge( factorReturns_, factorReturnsDict_[positionId2_], on =["start_time","end_time"],how="inner")
+        factorReturns_ = pairFactorReturns(factorReturnsDict_, positionId1_, positionId2_)
             
         weight_ = weightDict_[(positionId1_ ,positionId2_)]
         simulationResult_ = simulate(factorReturns_, simulationPeriod_,endTime_ ,weight_,positionId1_ , positionId2_,  fileName_ )
         
+        if USE_FAST:
+            selectHyperparameters(selected_, simulationResult_, simulationPeriod_)
+            continue
         for simulationTo_ in simulationPeriod_:
             output_ = simulationResult_[simulationResult_["simulation_period_to"] == simulationTo_  ].sort_values("mean",ascending = False,kind="mergesort").reset_index(drop=True)
             
@@ -1027,6 +2452,9 @@ def train(  calculateFactorReturn , simulationPeriod_ , calculateWeight,position
                     strategyInfo_[simulationTo_] = pd.concat([strategyInfo_[simulationTo_], output_.iloc[[row_]]])
 
     #結果の出力
+    if USE_FAST:
+        selectedFrame(selected_).to_csv( fileName_ + ".csv" , index=False )
+        return
     ret_ = pd.DataFrame()
     for simulationTo_ in simulationPeriod_:
         try:
@@ -1084,11 +2512,520 @@ def train_NY17NY17_C( LastSimulationPeriod_):
             fileName_ = DIRECTORY+"train/output/summary/train_result_NY17NY17_C")
 
 
-def testForSim(  calculateFactorReturn , calculateFactorReturn2 ,simulationPeriod_ , calculateWeight,  fileName_,outputName_,strategyName_ = "strategy"):
+########################################################################################3
+# train の並列実行
+# ジョブ（セッション × ファミリー）をポジションの組ごとの作業単位に分け、ProcessPoolExecutor で実行する
+########################################################################################3
+
+# ジョブ名: (ファクターリターン関数, シミュレーション開始年, ウェイト関数, ポジション関数)
+TRAIN_JOB = {
+    "NY17TK20_A": (makeFactorReturnA_TK20, 2005, makeWeightA_TK20, POSITION_FUNCTIONS_A),
+    "NY17TK20_B": (makeFactorReturnB_TK20, 2006, makeWeightB_TK20, POSITION_FUNCTIONS_B),
+    "NY17TK20_C": (makeFactorReturnC_TK20, 2005, makeWeightC_TK20, POSITION_FUNCTIONS_C),
+    "NY17NY17_A": (makeFactorReturnA_NY17, 2005, makeWeightA_NY17, POSITION_FUNCTIONS_A),
+    "NY17NY17_B": (makeFactorReturnB_NY17, 2006, makeWeightB_NY17, POSITION_FUNCTIONS_B),
+    "NY17NY17_C": (makeFactorReturnC_NY17, 2005, makeWeightC_NY17, POSITION_FUNCTIONS_C),
+}
+
+def trainUnits(jobs_=None):
+    """
+    作業単位 (ジョブ名, positionId1_, positionId2_) のリスト（train と同じ順）
+    """
+    jobs_ = list(TRAIN_JOB) if jobs_ is None else jobs_
+    units_ = []
+    for job_ in jobs_:
+        for positionId1_ ,positionId2_  in itertools.combinations_with_replacement(range(0,len(TRAIN_JOB[job_][3]) ) ,2):
+            units_.append((job_, positionId1_, positionId2_))
+    return units_
+
+def prepareTrainJob(job_):
+    """
+    ジョブのファクターリターンを計算しておく（USE_FACTOR_RETURN_STORE=True なら保存され、各作業単位はそれを読み込む）
+    """
+    getEndTime(TRAIN_JOB[job_][0])
+
+def trainFirstYear():
+    """市場データの最初の年（作業単位の年ごとの結果はこの年から保存する）"""
+    return min(pd.Timestamp(getMarketData(rateType_, session_)["start_time"].min()).year for rateType_, session_ in RATE_LOADER)
+
+def trainUnit(job_, positionId1_, positionId2_, LastSimulationPeriod_, fromYear_=None):
+    """
+    1つのポジションの組について、格子点ごとの戦略リターンの年ごとの統計を求める
+    
+    上位の選択（THRESHOLD, NUMBER_OF_HYPERPARAMETER, SIMULATION_RANKING）と年ごとの平均は writeTrainResults で行うので、
+    選択条件だけを変えた場合や最終年が進んだ場合は、保存済みの年の結果をそのまま使える。
+    fromYear_ を指定した場合は、格子もその年の end_time を含む時点からだけ計算する。
+    
+    Args:
+        fromYear_: この年以降（end_time の年）だけ計算する（省略時は trainFirstYear() から）
+    
+    Returns:
+        年をキー、(個数, 格子点ごとの yearStatistics (YEAR_STATISTICS × 格子点), 共通時点がない年の平均 または None) を値に持つdict
+    """
+    calculateFactorReturn, firstSimulationPeriod_, calculateWeight, positionFunctions_ = TRAIN_JOB[job_]
+    firstYear_ = trainFirstYear()
+    fromYear_ = firstYear_ if fromYear_ is None else fromYear_
+    
+    endTime_ = getEndTime(calculateFactorReturn)
+    factorReturnsDict_ = {}
+    for positionId_ in (positionId1_, positionId2_):
+        factorReturnsDict_[positionId_] = calculateFactorReturn(pd.DataFrame(), positionId_)
+    factorReturns_ = pairFactorReturns(factorReturnsDict_, positionId1_, positionId2_)
+    # end_time の年が fromYear_ 以降の時点だけ計算する（end_time は start_time の1週間後（getEndTime）なので2週間の余裕を取る）
+    from_ = pd.Timestamp(fromYear_, 1, 1) - pd.Timedelta(weeks = 2) if fromYear_ > firstYear_ else None
+    grid_ = simulateGrid(factorReturns_.drop("end_time",axis=1), from_ = from_)
+    values_, year_ = simulateYearValues(grid_, endTime_)
+    years_ = list(range(fromYear_, LastSimulationPeriod_+1))
+    count_, stats_ = yearStatistics(values_, year_, years_)
+    
+    result_ = {}
+    for i_, y_ in enumerate(years_):
+        fallback_ = None
+        # 共通時点がない年（最初からの累積が0）は平均を別に求めておく（全期間を計算した場合のみ。
+        # 途中の年から計算するのは、それより前の年に共通時点がある場合だけ（trainFromYear））
+        if from_ is None and y_ >= firstSimulationPeriod_ and count_[:i_+1].sum() == 0:
+            fallback_ = simulateFallbackMean(values_, year_, y_)
+        result_[y_] = (count_[i_], stats_[i_], fallback_)
+    return result_
+
+def trainFromYear(stored_, LastSimulationPeriod_, firstYear_):
+    """
+    作業単位をどの年から計算するか（保存済みの年の結果が揃っていれば None）
+    
+    保存済みの年が最初から連続していて共通時点が1つ以上あれば、その次の年から計算する。
+    それ以外（共通時点がない年の平均が要る場合）は最初から計算する。
+    """
+    years_ = range(firstYear_, LastSimulationPeriod_+1)
+    missing_ = [y_ for y_ in years_ if y_ not in stored_]
+    if len(missing_) == 0:
+        return None
+    if missing_[0] > firstYear_ and sum(stored_[y_][0] for y_ in range(firstYear_, missing_[0])) > 0:
+        return missing_[0]
+    return firstYear_
+
+def trainAll(LastSimulationPeriod_, marketData_=None, jobs_=None, maxWorkers_=None):
+    """
+    全ジョブの train を作業単位に分けて並列に実行し、ジョブごとに train_result_*.csv を出力する
+    
+    作業単位はプロセスプールに動的に割り当てられるので、実行時間は最も重いジョブではなくコア数に応じて短くなる。
+    結果は作業単位の順（train と同じ順）に並べ直すので、出力は train_NY17TK20_A などを個別に実行した場合と同じ。
+    作業単位の年ごとの結果はチェックポイントに保存し、中断後の再実行では完了済みの単位を飛ばす。
+    最終年が進んだ場合は、各作業単位とも保存済みの年の次の年から計算する。
+    
+    Args:
+        LastSimulationPeriod_: シミュレーション最終年
+        marketData_: shareMarketData() のハンドル（ワーカーで attachMarketData() する。省略時は各ワーカーで読み込む）
+        jobs_: 実行するジョブ名のリスト（省略時は TRAIN_JOB の全て）
+        maxWorkers_: ワーカー数（省略時は CPU 数）
+    """
+    jobs_, units_, checkpoint_, results_, fromYears_ = trainPlan(LastSimulationPeriod_, jobs_)
+    remaining_ = list(fromYears_)
+    initializer_, initargs_ = (attachMarketData, (marketData_,)) if marketData_ is not None else (None, ())
+    with ProcessPoolExecutor(max_workers = maxWorkers_ or os.cpu_count(), initializer = initializer_, initargs = initargs_) as executor_:
+        # ファクターリターンはジョブごとに1回だけ計算する
+        for future_ in [executor_.submit(prepareTrainJob, job_) for job_ in jobs_ if any(units_[id_][0] == job_ for id_ in remaining_)]:
+            future_.result()
+        futures_ = {executor_.submit(trainUnit, *units_[id_], LastSimulationPeriod_, fromYears_[id_]): id_ for id_ in remaining_}
+        for future_ in as_completed(futures_):
+            id_ = futures_[future_]
+            result_ = future_.result()
+            saveTrainCheckpoint(checkpoint_, units_[id_], result_)
+            results_[id_].update(result_)
+    writeTrainResults(LastSimulationPeriod_, jobs_, units_, [results_[id_] for id_ in range(len(units_))])
+
+########################################################################################3
+# 結果キャッシュ
+# ジョブの入力（市場データ・ポジション関数ファイル・設定値・入力ファイル・期間）のハッシュをキーに、
+# 出力ファイルを CACHEPATH/results/<キー>/ に保存する。入力が同じなら計算せずに出力ファイルを復元する。
+# 中間段階（ファクターリターン: CACHEPATH/factor_returns/、作業単位: チェックポイント）はそれぞれの入力だけで
+# キーが決まるので、例えば THRESHOLD だけを変えた場合は上位の選択以降だけが再計算される。
+########################################################################################3
+
+def resultCacheKey(kind_, inputs_):
+    """
+    Args:
+        kind_: ジョブの種類
+        inputs_: ジョブ固有の入力のリスト（("file", パス) はファイルの内容、それ以外は値をハッシュする）
+    """
+    hash_ = hashlib.sha1()
+    inputFingerprint(hash_)
+    hash_.update(json.dumps([RESULT_CACHE_VERSION, NUMBER_OF_HYPERPARAMETER, THRESHOLD, SIMULATION_RANKING, list(LAG_RANGE), kind_]).encode())
+    for input_ in inputs_:
+        if isinstance(input_, tuple) and input_[0] == "file":
+            with open(input_[1], "rb") as f:
+                hash_.update(f.read())
+        else:
+            hash_.update(json.dumps(input_, default = str).encode())
+    return hash_.hexdigest()
+
+def loadResultCache(key_, outputFiles_):
+    """キャッシュがあれば出力ファイルを復元して True を返す（最終使用時刻を更新する）"""
+    folder_ = CACHEPATH + "results/" + key_
+    if not USE_RESULT_CACHE or not os.path.exists(folder_ + "/meta.json"):
+        return False
+    for i_, file_ in enumerate(outputFiles_):
+        shutil.copyfile(folder_ + "/" + str(i_), file_)
+    os.utime(folder_ + "/meta.json")
+    return True
+
+def saveResultCache(key_, outputFiles_):
+    """
+    出力ファイルをキャッシュに保存し、上限を超えた分を削除する（出力が揃っていない場合は保存しない）
+    """
+    if not USE_RESULT_CACHE or not all(os.path.exists(file_) for file_ in outputFiles_):
+        return
+    def write(tmp_):
+        for i_, file_ in enumerate(outputFiles_):
+            shutil.copyfile(file_, tmp_ + "/" + str(i_))
+        with open(tmp_ + "/meta.json", "w") as f:
+            json.dump({"outputs": [os.path.basename(file_) for file_ in outputFiles_]}, f)
+    publishFolder(CACHEPATH + "results/" + key_, write)
+    evictResultCache()
+
+def evictResultCache():
+    """合計サイズが RESULT_CACHE_MAX_BYTES を超えている間、最終使用時刻が古いものから削除する"""
+    entries_ = []
+    for meta_ in glob.glob(CACHEPATH + "results/*/meta.json"):
+        folder_ = os.path.dirname(meta_)
+        size_ = sum(os.path.getsize(file_) for file_ in glob.glob(folder_ + "/*"))
+        entries_.append((os.path.getmtime(meta_), size_, folder_))
+    total_ = sum(size_ for _, size_, _ in entries_)
+    for _, size_, folder_ in sorted(entries_):
+        if total_ <= RESULT_CACHE_MAX_BYTES:
+            break
+        shutil.rmtree(folder_, ignore_errors=True)
+        total_ -= size_
+
+########################################################################################3
+# train のチェックポイント（年ごとの結果の保存）
+# 作業単位 × end_time の年ごとに、格子点ごとの戦略リターンの年の統計（和・個数など）を SQLite に保存する。
+# 各年までの平均は保存した年の和の累積から求める（yearMeans）。
+#   - 中断後の再実行では、全ての年が揃っている作業単位を飛ばす
+#   - 最終年が進んだ場合は、保存済みの年の次の年から計算する（古い年の和は変わらない）
+# 年 y の結果は市場データの翌年1月末までの部分にしかよらないので、その部分のハッシュと一緒に保存し、
+# 一致しない（過去のデータが修正された）年の結果は使わない。設定値が変わった場合も使わない。
+########################################################################################3
+
+def configFingerprint(hash_):
+    """
+    simulate までの結果に影響する設定（ポジション関数ファイル・コスト・ウィンドウ・格子）を hash_ に加える
+    """
+    for file_ in sorted(glob.glob(INPUTPATH + "position/*.csv")):
+        with open(file_, "rb") as f:
+            hash_.update(f.read())
+    hash_.update(json.dumps(sorted(COST.items())).encode())
+    for family_ in sorted(FACTOR_FAMILY):
+        hash_.update(json.dumps(list(FACTOR_FAMILY[family_][2])).encode())
+        hash_.update(FACTOR_FAMILY[family_][1].tobytes())
+    hash_.update(json.dumps([REF_PERIOD_WIDTH, TRADE_PERIOD_WIDTH, NUMBER_OF_PARAMETERS, USE_FAST, YEAR_STATISTICS]).encode())
+
+def inputFingerprint(hash_):
+    """
+    simulate までの結果に影響する入力（全セッションの市場データと configFingerprint の設定）を hash_ に加える
+    """
+    for rateType_, session_ in RATE_LOADER:
+        frameFingerprint(hash_, getMarketData(rateType_, session_))
+    configFingerprint(hash_)
+
+def marketPrefixFingerprint(year_):
+    """
+    end_time の年が year_ の時点の結果に影響する市場データ（翌年1月末まで）のハッシュ
+    """
+    cutoff_ = pd.Timestamp(year_+1, 2, 1)
+    hash_ = hashlib.sha1()
+    for rateType_, session_ in RATE_LOADER:
+        frame_ = getMarketData(rateType_, session_)
+        frameFingerprint(hash_, frame_[frame_["start_time"] < cutoff_])
+    return hash_.hexdigest()
+
+def openTrainCheckpoint(LastSimulationPeriod_):
+    """
+    チェックポイントを開く（USE_TRAIN_CHECKPOINT=False の場合は None）
+    
+    設定が異なる結果と、市場データのハッシュが一致しない年の結果は削除する。
+    
+    Returns:
+        (sqlite3 接続, 設定のハッシュ, 年をキー・市場データのハッシュを値に持つdict) または None
+    """
+    if not USE_TRAIN_CHECKPOINT:
+        return None
+    os.makedirs(os.path.dirname(TRAIN_CHECKPOINT_PATH), exist_ok=True)
+    hash_ = hashlib.sha1()
+    configFingerprint(hash_)
+    config_ = hash_.hexdigest()
+    market_ = {y_: marketPrefixFingerprint(y_) for y_ in range(trainFirstYear(), LastSimulationPeriod_+1)}
+    connection_ = sqlite3.connect(TRAIN_CHECKPOINT_PATH)
+    connection_.execute("CREATE TABLE IF NOT EXISTS train_stats (config TEXT, market TEXT, job TEXT, position_id_1 INTEGER, position_id_2 INTEGER, "
+                        "year INTEGER, count REAL, stats BLOB, fallback BLOB, PRIMARY KEY (config, job, position_id_1, position_id_2, year))")
+    connection_.execute("DELETE FROM train_stats WHERE config != ?", (config_,))
+    for y_, fingerprint_ in market_.items():
+        connection_.execute("DELETE FROM train_stats WHERE year = ? AND market != ?", (y_, fingerprint_))
+    connection_.commit()
+    return connection_, config_, market_
+
+def loadTrainCheckpoint(checkpoint_, units_):
+    """
+    保存済みの年ごとの結果を返す
+    
+    Returns:
+        units_ の位置をキー、trainUnit の結果の形式（年 → (個数, yearStatistics, 平均 または None)）を値に持つdict
+    """
+    stored_ = {id_: {} for id_ in range(len(units_))}
+    if checkpoint_ is None:
+        return stored_
+    connection_, config_, market_ = checkpoint_
+    position_ = {unit_: id_ for id_, unit_ in enumerate(units_)}
+    for job_, positionId1_, positionId2_, year_, count_, stats_, fallback_ in connection_.execute(
+            "SELECT job, position_id_1, position_id_2, year, count, stats, fallback FROM train_stats WHERE config = ?", (config_,)):
+        id_ = position_.get((job_, positionId1_, positionId2_))
+        if id_ is not None and year_ in market_:
+            stored_[id_][year_] = (count_, np.frombuffer(stats_, dtype = np.float64).reshape(len(YEAR_STATISTICS), -1),
+                                   None if fallback_ is None else np.frombuffer(fallback_, dtype = np.float64))
+    return stored_
+
+def saveTrainCheckpoint(checkpoint_, unit_, result_):
+    """作業単位の年ごとの結果を保存する（1単位ごとにコミット）"""
+    if checkpoint_ is None:
+        return
+    connection_, config_, market_ = checkpoint_
+    for y_, (count_, stats_, fallback_) in result_.items():
+        connection_.execute("INSERT OR REPLACE INTO train_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (config_, market_[y_], unit_[0], int(unit_[1]), int(unit_[2]), int(y_), float(count_),
+                             np.ascontiguousarray(stats_, dtype = np.float64).tobytes(),
+                             None if fallback_ is None else np.ascontiguousarray(fallback_, dtype = np.float64).tobytes()))
+    connection_.commit()
+
+def trainPlan(LastSimulationPeriod_, jobs_=None):
+    """
+    計算が必要なジョブ・作業単位と、各作業単位をどの年から計算するかを決める
+    
+    Returns:
+        jobs_: 計算するジョブ（結果キャッシュから復元できたものを除く）
+        units_: 作業単位のリスト
+        checkpoint_: openTrainCheckpoint の結果
+        results_: 作業単位の位置 → 保存済みの年ごとの結果
+        fromYears_: 計算が必要な作業単位の位置 → 計算を始める年
+    """
+    jobs_ = trainJobsToRun(LastSimulationPeriod_, jobs_)
+    units_ = trainUnits(jobs_)
+    checkpoint_ = openTrainCheckpoint(LastSimulationPeriod_)
+    results_ = loadTrainCheckpoint(checkpoint_, units_)
+    firstYear_ = trainFirstYear()
+    fromYears_ = {}
+    for id_ in range(len(units_)):
+        fromYear_ = trainFromYear(results_[id_], LastSimulationPeriod_, firstYear_)
+        if fromYear_ is not None:
+            fromYears_[id_] = fromYear_
+    return jobs_, units_, checkpoint_, results_, fromYears_
+
+def writeTrainResults(LastSimulationPeriod_, jobs_, units_, results_):
+    """
+    作業単位の結果から単位の順に上位を選び、ジョブごとに train_result_*.csv を出力する（結果キャッシュにも保存する）
+    """
+    for job_ in jobs_:
+        simulationPeriod_ = range(TRAIN_JOB[job_][1], LastSimulationPeriod_+1)
+        selected_ = {}
+        for simulationTo_ in simulationPeriod_:
+            selected_[simulationTo_] = []
+        for (unitJob_, positionId1_, positionId2_), result_ in zip(units_, results_):
+            if unitJob_ == job_:
+                years_ = sorted(y_ for y_ in result_ if y_ <= LastSimulationPeriod_)
+                count_ = [result_[y_][0] for y_ in years_]
+                stats_ = np.array([result_[y_][1] for y_ in years_]).reshape(len(years_), len(YEAR_STATISTICS), len(gridColumns()))
+                means_ = yearMeans(years_, stats_[:, 0], count_, {y_: result_[y_][2] for y_ in years_}, simulationPeriod_, gridColumns())
+                rankings_ = None if SIMULATION_RANKING == "mean" else expandingStatistics(years_, count_, stats_, simulationPeriod_, gridColumns())
+                selectHyperparameters(selected_, simulationOutput(means_, simulationPeriod_, positionId1_, positionId2_, rankings_), simulationPeriod_)
+        selectedFrame(selected_).to_csv( trainResultFile(job_) , index=False )
+        saveResultCache(trainResultKey(LastSimulationPeriod_, job_), [trainResultFile(job_)])
+
+def trainResultFile(job_):
+    return DIRECTORY+"train/output/summary/train_result_"+job_ + ".csv"
+
+def trainResultKey(LastSimulationPeriod_, job_):
+    calculateFactorReturn, firstSimulationPeriod_, calculateWeight, positionFunctions_ = TRAIN_JOB[job_]
+    return resultCacheKey("train", [job_, calculateFactorReturn.__name__, calculateWeight.__name__, len(positionFunctions_),
+                                    firstSimulationPeriod_, LastSimulationPeriod_])
+
+def trainJobsToRun(LastSimulationPeriod_, jobs_=None):
+    """
+    入力が変わっていないジョブは結果キャッシュから train_result_*.csv を復元し、計算が必要なジョブだけを返す
+    """
+    jobs_ = list(TRAIN_JOB) if jobs_ is None else jobs_
+    return [job_ for job_ in jobs_ if not loadResultCache(trainResultKey(LastSimulationPeriod_, job_), [trainResultFile(job_)])]
+
+########################################################################################3
+# train の複数ホスト実行
+# コーディネーターが作業単位を TCP (multiprocessing.managers) で配り、ワーカーが取りに来て結果を返す
+#   python train.py --coordinator [HOST:]PORT
+#   python train.py --worker HOST:PORT
+# 認証キーは環境変数 TRAIN_AUTHKEY（コーディネーターと全ワーカーで同じ値）
+########################################################################################3
+
+TRAIN_UNIT_TIMEOUT = 6*3600 # 開始後この秒数で結果が返らない作業単位は再投入する（trainCoordinator の unitTimeout_ の既定値）
+TRAIN_UNIT_RETRY = 3 # 失敗した作業単位を再投入する回数の上限
+TRAIN_IDLE_TIMEOUT = 30*60 # 実行中の作業単位がなく、この秒数どのワーカーからも連絡がなければコーディネーターを終了する
+TRAIN_CONNECT_RETRY = 10 # ワーカーがコーディネーターへの接続を試みる回数の上限（間隔は1, 2, 4, ... 秒、最大60秒）
+
+class TrainQueueManager(BaseManager):
+    pass
+
+def trainAuthkey():
+    authkey_ = os.getenv("TRAIN_AUTHKEY")
+    if not authkey_:
+        raise ValueError("環境変数 TRAIN_AUTHKEY を設定してください（コーディネーターと全ワーカーで同じ値）")
+    return authkey_.encode()
+
+def parseAddress(address_):
+    """ "HOST:PORT" または "PORT" を (HOST, PORT) にする（HOST省略時は全インターフェース） """
+    host_, _, port_ = address_.rpartition(":")
+    return (host_, int(port_))
+
+def trainCoordinator(LastSimulationPeriod_, address_, jobs_=None, authkey_=None, unitTimeout_=None):
+    """
+    作業単位をキューで配り、全単位の結果が揃ったら train_result_*.csv を出力する
+    
+    ワーカーは開始時に ("start", id)、終了時に ("done", id, 結果) か ("fail", id, エラー) を返す。
+    失敗した単位と unitTimeout_ 秒を過ぎても終わらない単位（ワーカーの停止など）は再投入する。
+    同じ単位の結果が複数返った場合は最初のものを使う（結果は決定的なのでどれでも同じ）。
+    結果はチェックポイントに保存し、再起動時は完了済みの単位を配らない。
+    実行中の単位がないまま TRAIN_IDLE_TIMEOUT 秒どのワーカーからも連絡がない場合は、
+    生きているワーカーがないとみなして RuntimeError で終了する（完了済みの単位はチェックポイントに残る）。
+    
+    Args:
+        LastSimulationPeriod_: シミュレーション最終年
+        address_: 待ち受けるアドレス (HOST, PORT)
+        jobs_: 実行するジョブ名のリスト（省略時は TRAIN_JOB の全て）
+        authkey_: 認証キー（省略時は環境変数 TRAIN_AUTHKEY）
+        unitTimeout_: 作業単位を再投入するまでの秒数（省略時は TRAIN_UNIT_TIMEOUT。
+                      遅いワーカーでは長く、ワーカーの停止を早く検知したい場合は短くする）
+    """
+    unitTimeout_ = TRAIN_UNIT_TIMEOUT if unitTimeout_ is None else unitTimeout_
+    jobs_, units_, checkpoint_, results_, fromYears_ = trainPlan(LastSimulationPeriod_, jobs_)
+    done_ = set(id_ for id_ in range(len(units_)) if id_ not in fromYears_)
+    taskQueue_ = queue.Queue()
+    resultQueue_ = queue.Queue()
+    TrainQueueManager.register("tasks", callable = lambda: taskQueue_)
+    TrainQueueManager.register("results", callable = lambda: resultQueue_)
+    manager_ = TrainQueueManager(address = address_, authkey = authkey_ or trainAuthkey())
+    server_ = manager_.get_server()
+    threading.Thread(target = server_.serve_forever, daemon = True).start()
+    print("coordinator: %d units (%d from checkpoint) on %s:%d" % (len(units_), len(done_), socket.gethostname(), server_.address[1]), file=sys.stderr)
+    
+    attempts_ = {}
+    started_ = {}
+    lastContact_ = time.time()
+    def enqueue(id_):
+        nonlocal lastContact_
+        started_.pop(id_, None)
+        lastContact_ = time.time()
+        attempts_[id_] = attempts_.get(id_, -1) + 1
+        if attempts_[id_] > TRAIN_UNIT_RETRY:
+            raise RuntimeError("作業単位 %s が %d 回失敗しました" % (units_[id_], attempts_[id_]))
+        taskQueue_.put((id_, units_[id_], LastSimulationPeriod_, fromYears_[id_]))
+    for id_ in fromYears_:
+        enqueue(id_)
+    
+    while len(done_) < len(units_):
+        try:
+            message_ = resultQueue_.get(timeout = 10)
+        except queue.Empty:
+            message_ = None
+        if message_ is not None:
+            lastContact_ = time.time()
+        if message_ is not None and message_[1] not in done_:
+            kind_, id_ = message_[0], message_[1]
+            if kind_ == "start":
+                started_[id_] = time.time()
+            elif kind_ == "done":
+                done_.add(id_)
+                started_.pop(id_, None)
+                saveTrainCheckpoint(checkpoint_, units_[id_], message_[2])
+                results_[id_].update(message_[2])
+            elif kind_ == "fail":
+                print("coordinator: unit %s failed, requeue\n%s" % (units_[id_], message_[2]), file=sys.stderr)
+                enqueue(id_)
+        for id_, startTime_ in list(started_.items()):
+            if time.time() - startTime_ > unitTimeout_:
+                print("coordinator: unit %s timed out, requeue" % (units_[id_],), file=sys.stderr)
+                enqueue(id_)
+        if len(started_) == 0 and time.time() - lastContact_ > TRAIN_IDLE_TIMEOUT:
+            raise RuntimeError("%d 秒間ワーカーから連絡がありません（残り %d 単位）。ワーカーを起動して再実行してください"
+                               % (TRAIN_IDLE_TIMEOUT, len(units_) - len(done_)))
+    
+    # ワーカーへの終了通知（ワーカーは受け取ったら戻して終了する）
+    taskQueue_.put(None)
+    writeTrainResults(LastSimulationPeriod_, jobs_, units_, [results_[id_] for id_ in range(len(units_))])
+    time.sleep(1)
+
+def trainWorker(address_, authkey_=None):
+    """
+    コーディネーターから作業単位を取り出して trainUnit を実行し、結果を返す（終了通知かコーディネーターの停止まで）
+    
+    コーディネーターがまだ起動していない場合は、間隔を倍にしながら TRAIN_CONNECT_RETRY 回まで接続を試みる。
+    """
+    TrainQueueManager.register("tasks")
+    TrainQueueManager.register("results")
+    manager_ = TrainQueueManager(address = address_, authkey = authkey_ or trainAuthkey())
+    for attempt_ in range(TRAIN_CONNECT_RETRY):
+        try:
+            manager_.connect()
+            break
+        except OSError:
+            if attempt_ == TRAIN_CONNECT_RETRY - 1:
+                raise
+            wait_ = min(2**attempt_, 60)
+            print("worker: cannot connect to %s:%d, retry in %d s" % (address_[0], address_[1], wait_), file=sys.stderr)
+            time.sleep(wait_)
+    taskQueue_ = manager_.tasks()
+    resultQueue_ = manager_.results()
+    count_ = 0
+    while True:
+        try:
+            task_ = taskQueue_.get()
+        except (EOFError, OSError):
+            break
+        if task_ is None:
+            taskQueue_.put(None)
+            break
+        id_, (job_, positionId1_, positionId2_), LastSimulationPeriod_, fromYear_ = task_
+        resultQueue_.put(("start", id_))
+        try:
+            result_ = trainUnit(job_, positionId1_, positionId2_, LastSimulationPeriod_, fromYear_)
+        except Exception:
+            resultQueue_.put(("fail", id_, traceback.format_exc()))
+            continue
+        resultQueue_.put(("done", id_, result_))
+        count_ += 1
+    print("worker: %d units done" % count_, file=sys.stderr)
+
+def testForSimDetailFolder(outputName_):
+    """testForSim の lag ごとの出力フォルダ"""
     if "test_result_NY17NY17_NY17NY17_NY17TK1630" in outputName_:
-        detailOutputFolder_ = "test/output/detail/TK1630/"
+        return "test/output/detail/TK1630/"
     elif "test_result_NY17NY17_NY17NY17_NY17TK20" in outputName_:
-        detailOutputFolder_ = "test/output/detail/TK20/"
+        return "test/output/detail/TK20/"
+
+def testForSimOutputFiles(outputName_):
+    """
+    testForSim が lag ごとに出力するファイル
+    
+    Returns:
+        LAG_RANGE の順に (リターン, 集計, ウェイト) のパスを並べたリスト
+    """
+    detailOutputFolder_ = testForSimDetailFolder(outputName_)
+    outputFiles_ = []
+    for lag_ in LAG_RANGE:
+        outputFiles_ += [detailOutputFolder_ + outputName_ +"_lag="+str(lag_)+".csv",
+                         detailOutputFolder_ + outputName_ +"_lag="+str(lag_)+"_summary.csv",
+                         detailOutputFolder_ + outputName_ +"_lag="+str(lag_)+"_weight.csv"]
+    return outputFiles_
+
+def testForSim(  calculateFactorReturn , calculateFactorReturn2 ,simulationPeriod_ , calculateWeight,  fileName_,outputName_,strategyName_ = "strategy"):
+    """
+    Returns:
+        calculateFactorReturn を指定した場合は出力したファイル（testForSimOutputFiles）。該当年の戦略がなく出力しなかった場合は None
+    """
+    detailOutputFolder_ = testForSimDetailFolder(outputName_)
     summaryOutputFolder_ = "test/output/summary/"
     
     
@@ -1127,12 +3064,8 @@ def testForSim(  calculateFactorReturn , calculateFactorReturn2 ,simulationPerio
                 
                 factorReturns_ = pd.DataFrame() 
                 factorReturns2_ = pd.DataFrame() 
-                factorReturns_ = factorReturnsDict1_[positionId1_]
-                factorReturns2_ = factorReturnsDict2_[positionId1_]
-                
-                if positionId1_ != positionId2_: 
-                    factorReturns_ = pd.merge( factorReturns_, factorReturnsDict1_[positionId2_], on =["start_time","end_time"],how="inner")
-                    factorReturns2_ = pd.merge( factorReturns2_, factorReturnsDict2_[positionId2_], on =["start_time","end_time"],how="inner")
+                factorReturns_ = pairFactorReturns(factorReturnsDict1_, positionId1_, positionId2_)
+                factorReturns2_ = pairFactorReturns(factorReturnsDict2_, positionId1_, positionId2_)
                     
                     
                 weight_ = weightDict_[(positionId1_ ,positionId2_)]
@@ -1164,11 +3097,14 @@ def testForSim(  calculateFactorReturn , calculateFactorReturn2 ,simulationPerio
                 ret_[lag_] = pd.concat([ret_[lag_], strategyReturn_[strategyReturn_["start_time"].dt.year ==  simulationTo_ + lag_][["start_time",strategyName_]]])
                 ret2_[lag_] = pd.concat([ret2_[lag_], strategyWeight_[strategyWeight_["start_time"].dt.year ==  simulationTo_ + lag_]])
         
-        for lag_ in LAG_RANGE:
+        summaries_ = performanceSummaries([(ret_[lag_], strategyName_, False) for lag_ in LAG_RANGE])
+        outputFiles_ = testForSimOutputFiles(outputName_)
+        for i_, (lag_, summary_) in enumerate(zip(LAG_RANGE, summaries_)):
 
-                ret_[lag_].to_csv( detailOutputFolder_ + outputName_ +"_lag="+str(lag_)+".csv" )
-                performanceSummary(ret_[lag_], strategyName_ ).to_csv(detailOutputFolder_ + outputName_ +"_lag="+str(lag_)+"_summary.csv", index=True )
-                ret2_[lag_].to_csv( detailOutputFolder_ + outputName_ +"_lag="+str(lag_)+"_weight.csv" )
+                ret_[lag_].to_csv( outputFiles_[3*i_] )
+                summary_.to_csv(outputFiles_[3*i_+1], index=True )
+                ret2_[lag_].to_csv( outputFiles_[3*i_+2] )
+        return outputFiles_
 
 
     else : 
@@ -1202,28 +3138,43 @@ def testForSim(  calculateFactorReturn , calculateFactorReturn2 ,simulationPerio
         df_["start_time"] = pd.to_datetime(df_["start_time"])
         df_["total"] = list( df_.set_index("start_time").mean(axis=1))
         
-        performanceSummary(df_, "total").to_csv( summaryOutputFolder_ + outputName_+"_simple.csv")
-        performanceSummary2(df_, "total").to_csv(summaryOutputFolder_ + outputName_+"_compound.csv")
-        performanceSummary2(df_[df_["start_time"].dt.year >= 2015 ], "total").to_csv(summaryOutputFolder_ + outputName_+"_compound_since2015.csv")
+        simple_, compound_, compoundSince2015_ = performanceSummaries([(df_, "total", False), (df_, "total", True), (df_[df_["start_time"].dt.year >= 2015 ], "total", True)])
+        simple_.to_csv( summaryOutputFolder_ + outputName_+"_simple.csv")
+        compound_.to_csv(summaryOutputFolder_ + outputName_+"_compound.csv")
+        compoundSince2015_.to_csv(summaryOutputFolder_ + outputName_+"_compound_since2015.csv")
         targetWeight_ =  targetWeight_/cnt_ 
         targetWeight_ = targetWeight_.dropna()
         targetWeight_.to_csv(summaryOutputFolder_ + outputName_+"_targetWeight.csv")
         
 
+def cachedTestForSim(calculateFactorReturn , calculateFactorReturn2 ,simulationPeriod_ , calculateWeight,  fileName_,outputName_,strategyName_ = "strategy"):
+    """
+    testForSim の結果キャッシュ版（入力 train_result_*.csv・期間・市場データ・設定値が同じなら lag ごとの出力を復元する）
+    """
+    outputFiles_ = testForSimOutputFiles(outputName_)
+    key_ = resultCacheKey("testForSim", [calculateFactorReturn.__name__, calculateFactorReturn2.__name__, calculateWeight.__name__,
+                                         list(simulationPeriod_), ("file", fileName_ + ".csv"), outputName_, strategyName_])
+    if loadResultCache(key_, outputFiles_):
+        return
+    # 該当年の戦略がなく出力しなかった場合（None）は、以前の出力ファイルを保存しない
+    producedFiles_ = testForSim(calculateFactorReturn, calculateFactorReturn2, simulationPeriod_, calculateWeight, fileName_, outputName_, strategyName_)
+    if producedFiles_ is not None:
+        saveResultCache(key_, producedFiles_)
+
 def testForSim_NY17NY17_NY17NY17_NY17TK1630_A(LastSimulationPeriod_):
-    testForSim(  calculateFactorReturn = makeFactorReturnA_NY17TK1630,calculateFactorReturn2 = makeFactorReturnA_TK1630,
+    cachedTestForSim(  calculateFactorReturn = makeFactorReturnA_NY17TK1630,calculateFactorReturn2 = makeFactorReturnA_TK1630,
           simulationPeriod_ =range(2010,LastSimulationPeriod_+1) , calculateWeight = makeWeightA_TK1630,
           fileName_ = DIRECTORY+"test/input/input_by_train/train_result_NY17NY17_A", outputName_ = "test_result_NY17NY17_NY17NY17_NY17TK1630_A",
           strategyName_ = "strategy_A" )
 
 def testForSim_NY17NY17_NY17NY17_NY17TK1630_B(LastSimulationPeriod_):
-    testForSim(  calculateFactorReturn = makeFactorReturnB_NY17TK1630, calculateFactorReturn2 = makeFactorReturnB_TK1630,
+    cachedTestForSim(  calculateFactorReturn = makeFactorReturnB_NY17TK1630, calculateFactorReturn2 = makeFactorReturnB_TK1630,
           simulationPeriod_ =range(2010,LastSimulationPeriod_+1) , calculateWeight = makeWeightB_TK1630,
           fileName_ = DIRECTORY+"test/input/input_by_train/train_result_NY17NY17_B",  outputName_ = "test_result_NY17NY17_NY17NY17_NY17TK1630_B",
           strategyName_ = "strategy_B" )
 
 def testForSim_NY17NY17_NY17NY17_NY17TK1630_C(LastSimulationPeriod_):
-    testForSim(  calculateFactorReturn = makeFactorReturnC_NY17TK1630, calculateFactorReturn2 = makeFactorReturnC_TK1630,
+    cachedTestForSim(  calculateFactorReturn = makeFactorReturnC_NY17TK1630, calculateFactorReturn2 = makeFactorReturnC_TK1630,
           simulationPeriod_ =range(2010,LastSimulationPeriod_+1), calculateWeight = makeWeightC_TK1630,
           fileName_ = DIRECTORY+"test/input/input_by_train/train_result_NY17NY17_C", outputName_ = "test_result_NY17NY17_NY17NY17_NY17TK1630_C",
           strategyName_ = "strategy_C" )
@@ -1280,13 +3231,8 @@ def testForProd(  calculateFactorReturn , calculateFactorReturn2 ,simulationPeri
                 
                 factorReturns_ = pd.DataFrame() 
                 factorReturns2_ = pd.DataFrame() 
-                factorReturns_ = factorReturnsDict1_[positionId1_]
-                factorReturns2_ = factorReturnsDict2_[positionId1_]
-                
-                
-                if positionId1_ != positionId2_: 
-                    factorReturns_ = pd.merge( factorReturns_, factorReturnsDict1_[positionId2_], on =["start_time","end_time"],how="inner")
-                    factorReturns2_ = pd.merge( factorReturns2_, factorReturnsDict2_[positionId2_], on =["start_time","end_time"],how="inner")
+                factorReturns_ = pairFactorReturns(factorReturnsDict1_, positionId1_, positionId2_)
+                factorReturns2_ = pairFactorReturns(factorReturnsDict2_, positionId1_, positionId2_)
                     
                 weight_ = weightDict_[(positionId1_ ,positionId2_)]
                 
@@ -1328,9 +3274,10 @@ def testForProd(  calculateFactorReturn , calculateFactorReturn2 ,simulationPeri
                 ret_[lag_] = pd.concat([ret_[lag_], strategyReturn_[strategyReturn_["start_time"].dt.year ==  simulationTo_ + lag_][["start_time",strategyName_]]])
                 ret2_[lag_] = pd.concat([ret2_[lag_], strategyWeight_[strategyWeight_["start_time"].dt.year ==  simulationTo_ + lag_]])
         
-        for lag_ in LAG_RANGE:
+        summaries_ = performanceSummaries([(ret_[lag_], strategyName_, False) for lag_ in LAG_RANGE])
+        for lag_, summary_ in zip(LAG_RANGE, summaries_):
                 ret_[lag_].to_csv(outputName_ +"_lag="+str(lag_)+".csv" )
-                performanceSummary(ret_[lag_], strategyName_ ).to_csv(outputName_ +"_lag="+str(lag_)+"_summary.csv", index=True )
+                summary_.to_csv(outputName_ +"_lag="+str(lag_)+"_summary.csv", index=True )
                 ret2_[lag_].to_csv(outputName_ +"_lag="+str(lag_)+"_weight.csv" )
     else : 
         df_ = pd.DataFrame()
@@ -1395,6 +3342,8 @@ def testForProd(  calculateFactorReturn , calculateFactorReturn2 ,simulationPeri
             
             df_.to_csv( DIRECTORY+"test/output/performance/performance"+"_"+ date_.strftime('%Y%m%d') +  ".csv",index=False)
             performanceSummary2(df_, "total" ).to_csv( DIRECTORY+"test/output/performance/performance_summary"+"_"+ date_.strftime('%Y%m%d') +  ".csv")
+            if USE_PERFORMANCE_STATE:
+                savePerformanceState(performanceStateFromFile(DIRECTORY+"test/output/performance/performance"+"_"+ date_.strftime('%Y%m%d') +  ".csv"), date_.strftime('%Y%m%d'))
             
         else:
             #############+++++++++++++++++++++++++++++++++++##########################
@@ -1411,12 +3360,25 @@ def testForProd(  calculateFactorReturn , calculateFactorReturn2 ,simulationPeri
             targetWeightOutput_ = targetWeightOutput_.rename(columns = { "start_time":""}) 
             targetWeightOutput_.to_csv(DIRECTORY+"test/output/prod/WeightFX" +"_"+ date_.strftime('%Y%m%d') +  ".csv",index=False)
             
-            dfPre_ = pd.read_csv(DIRECTORY+"test/output/performance/performance"+"_"+ datePre_ +  ".csv")
-            dfPre_["start_time"] =  pd.to_datetime(dfPre_["start_time"])
-            df_ = pd.concat([dfPre_, df_])
-            df_ = df_.drop_duplicates("start_time")
-            df_[["start_time","total"]].to_csv( DIRECTORY+"test/output/performance/performance"+"_"+ date_.strftime('%Y%m%d') +  ".csv",index=False)
-            performanceSummary2(df_, "total" ).to_csv( DIRECTORY+"test/output/performance/performance_summary"+"_"+ date_.strftime('%Y%m%d') +  ".csv")
+            state_ = loadPerformanceState(datePre_)
+            if state_ is not None:
+                # 保存済みの状態に今回の新しい行だけを加え、前回のファイルにその行を書き足す
+                added_ = appendPerformance(state_, df_)
+                if datePre_ != date_.strftime('%Y%m%d'):
+                    shutil.copyfile(DIRECTORY+"test/output/performance/performance"+"_"+ datePre_ +  ".csv", DIRECTORY+"test/output/performance/performance"+"_"+ date_.strftime('%Y%m%d') +  ".csv")
+                if len(added_) > 0:
+                    added_[["start_time","total"]].to_csv( DIRECTORY+"test/output/performance/performance"+"_"+ date_.strftime('%Y%m%d') +  ".csv",index=False, header=False, mode="a")
+                performanceStateSummary(state_).to_csv( DIRECTORY+"test/output/performance/performance_summary"+"_"+ date_.strftime('%Y%m%d') +  ".csv")
+                savePerformanceState(state_, date_.strftime('%Y%m%d'))
+            else:
+                dfPre_ = pd.read_csv(DIRECTORY+"test/output/performance/performance"+"_"+ datePre_ +  ".csv")
+                dfPre_["start_time"] =  pd.to_datetime(dfPre_["start_time"])
+                df_ = pd.concat([dfPre_, df_])
+                df_ = df_.drop_duplicates("start_time")
+                df_[["start_time","total"]].to_csv( DIRECTORY+"test/output/performance/performance"+"_"+ date_.strftime('%Y%m%d') +  ".csv",index=False)
+                performanceSummary2(df_, "total" ).to_csv( DIRECTORY+"test/output/performance/performance_summary"+"_"+ date_.strftime('%Y%m%d') +  ".csv")
+                if USE_PERFORMANCE_STATE:
+                    savePerformanceState(performanceStateFromFile(DIRECTORY+"test/output/performance/performance"+"_"+ date_.strftime('%Y%m%d') +  ".csv"), date_.strftime('%Y%m%d'))
 
 
 
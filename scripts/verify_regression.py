@@ -136,6 +136,44 @@ def compare_train_results(old_file: str, new_file: str, tolerance: float = 1e-10
     return all_match, diff_summary
 
 
+def compare_train_results_exact(old_file: str, new_file: str):
+    """
+    トレーニング結果がバイト単位で一致するか比較
+    
+    USE_FAST=True どうしの比較（trainAll の新規実行と最終年を進めた実行、中断からの再開など）に使う。
+    USE_FAST=True の平均は年ごとの和の累積から求めるので、USE_FAST=False とは mean の下位数ビットが違う
+    （そちらは compare_train_results で比較する）。
+    
+    Args:
+        old_file: 基準の結果ファイル
+        new_file: 比較する結果ファイル
+    
+    Returns:
+        is_match: 一致フラグ
+    """
+    for file_ in (old_file, new_file):
+        if not Path(file_).exists():
+            raise FileNotFoundError(f"File not found: {file_}")
+    
+    old_lines = Path(old_file).read_text().splitlines()
+    new_lines = Path(new_file).read_text().splitlines()
+    
+    print(f"比較行数: old={len(old_lines)}, new={len(new_lines)}")
+    diff_rows = [i for i, (o, n) in enumerate(zip(old_lines, new_lines)) if o != n]
+    if len(old_lines) == len(new_lines) and len(diff_rows) == 0:
+        print("[OK] バイト単位で一致")
+        return True
+    
+    if len(old_lines) != len(new_lines):
+        print(f"[ERROR] 行数が不一致: old={len(old_lines)}, new={len(new_lines)}")
+    print(f"[ERROR] 不一致の行数: {len(diff_rows)}")
+    for i in diff_rows[:5]:
+        print(f"  line {i+1}:")
+        print(f"    old: {old_lines[i]}")
+        print(f"    new: {new_lines[i]}")
+    return False
+
+
 def compare_daily_pl(old_file: str, new_file: str, tolerance: float = 1e-10):
     """
     日次PL系列を比較（もしあれば）
@@ -219,6 +257,11 @@ def main():
   python scripts/verify_regression.py \\
       --old train/output/summary/train_result_NY17TK20_A_USE_FAST_FALSE.csv \\
       --new train/output/summary/train_result_NY17TK20_A_USE_FAST_TRUE.csv
+  
+  # USE_FAST=True どうしをバイト単位で比較（例: 新規実行と最終年を進めた実行）
+  python scripts/verify_regression.py --exact \\
+      --old train/output/summary/train_result_NY17TK20_A_FRESH.csv \\
+      --new train/output/summary/train_result_NY17TK20_A_INCREMENTAL.csv
         """
     )
     parser.add_argument('--old', type=str, required=True, 
@@ -226,6 +269,7 @@ def main():
     parser.add_argument('--new', type=str, required=True,
                        help='USE_FAST=True の結果ファイル（例: train/output/summary/train_result_NY17TK20_A_USE_FAST_TRUE.csv）')
     parser.add_argument('--tolerance', type=float, default=1e-10, help='許容誤差')
+    parser.add_argument('--exact', action='store_true', help='許容誤差を使わずバイト単位で比較する')
     parser.add_argument('--daily-pl-old', type=str, help='USE_FAST=False の日次PLファイル（オプション）')
     parser.add_argument('--daily-pl-new', type=str, help='USE_FAST=True の日次PLファイル（オプション）')
     
@@ -248,12 +292,15 @@ def main():
     print("=" * 60)
     print(f"Old file: {args.old}")
     print(f"New file: {args.new}")
-    print(f"Tolerance: {args.tolerance:.2e}")
+    print("Tolerance: exact" if args.exact else f"Tolerance: {args.tolerance:.2e}")
     print()
     
     # トレーニング結果を比較
     print("【トレーニング結果の比較】")
-    is_match, diff_summary = compare_train_results(args.old, args.new, args.tolerance)
+    if args.exact:
+        is_match = compare_train_results_exact(args.old, args.new)
+    else:
+        is_match, diff_summary = compare_train_results(args.old, args.new, args.tolerance)
     
     print()
     
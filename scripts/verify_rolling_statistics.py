@@ -0,0 +1,120 @@
+"""
+rollingStatistics の確認
+
+1. pandas の rolling(w).mean() / rolling(w).std() と一致すること（欠損・先頭 w-1 時点を含む）
+2. 全て同じ値のウィンドウは標準偏差がちょうど0、平均がその値になること
+3. 時点を追加しても、既存の時点の値が変わらないこと（ビット単位で一致）
+"""
+
+import sys
+import pandas as pd
+import numpy as np
+from pathlib import Path
+
+# lib.pyをインポート
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import lib
+
+
+WINDOWS = sorted(set(lib.FACTOR_CALCULATION_PERIOD_A) | set(lib.FACTOR_CALCULATION_PERIOD_B))
+
+
+def make_values(n_time, seed=0):
+    """
+    為替レートに近いダミーデータ（水準が大きく変動が小さい列・一定の区間・欠損を含む）
+    """
+    rng = np.random.default_rng(seed)
+    level = np.array([0.7, 0.75, 0.9, 1.1, 1.25, 110.0])
+    values = level * (1 + np.cumsum(rng.standard_normal((n_time, len(level))) * 1e-3, axis=0))
+    values[200:400, 0] = values[199, 0]      # 一定の区間（最長のウィンドウより長い）
+    values[500:530, 1] = 1.0                 # 一定の区間（ファクターAのウィンドウ程度）
+    values[700:705, 2] = np.nan              # 欠損
+    return values
+
+
+def test_pandas_agreement(values, rtol=1e-11):
+    """
+    pandas の rolling と比較する
+    
+    pandas は値の追加・削除で更新するので、誤差は値の水準に比例する（変動の小さいウィンドウの
+    標準偏差では相対誤差が大きくなる）。差はウィンドウの平均の絶対値に対する比で比べる。
+    """
+    print("【pandas rolling との比較】")
+    mean, std = lib.rollingStatistics(values, WINDOWS)
+    frame = pd.DataFrame(values)
+    ok = True
+    worst_mean, worst_std = 0.0, 0.0
+    for k, w in enumerate(WINDOWS):
+        expected_mean = frame.rolling(w).mean().values
+        expected_std = frame.rolling(w).std().values
+        if not (np.array_equal(np.isnan(mean[k]), np.isnan(expected_mean))
+                and np.array_equal(np.isnan(std[k]), np.isnan(expected_std))):
+            print(f"  ❌ w={w}: 欠損の位置が一致しません")
+            ok = False
+            continue
+        valid = ~np.isnan(expected_std)
+        scale = np.abs(expected_mean[valid])
+        worst_mean = max(worst_mean, np.max(np.abs(mean[k][valid] - expected_mean[valid]) / scale, initial=0.0))
+        worst_std = max(worst_std, np.max(np.abs(std[k][valid] - expected_std[valid]) / scale, initial=0.0))
+    print(f"  mean: max_diff/|mean|={worst_mean:.2e}")
+    print(f"  std:  max_diff/|mean|={worst_std:.2e}")
+    ok = ok and worst_mean <= rtol and worst_std <= rtol
+    print("  ✅ 一致" if ok else f"  ❌ 許容誤差 {rtol:.0e} を超えています")
+    return ok
+
+
+def test_constant_window(values):
+    """
+    全て同じ値のウィンドウの平均・標準偏差を確認する
+    """
+    print("【一定のウィンドウ】")
+    mean, std = lib.rollingStatistics(values, WINDOWS)
+    ok = True
+    for column, start, end in [(0, 199, 400), (1, 500, 530)]:
+        for k, w in enumerate(WINDOWS):
+            rows = np.arange(start + w - 1, end)
+            if len(rows) == 0:
+                continue
+            constant = values[rows, column]
+            if not (np.all(std[k][rows, column] == 0.0) and np.all(mean[k][rows, column] == constant)):
+                print(f"  ❌ 列{column} w={w}: std={np.max(std[k][rows, column]):.3e}, "
+                      f"mean_diff={np.max(np.abs(mean[k][rows, column] - constant)):.3e}")
+                ok = False
+    print("  ✅ 標準偏差は0、平均はその値と完全一致" if ok else "  ❌ 一定のウィンドウで誤差があります")
+    return ok
+
+
+def test_prefix_stability(values):
+    """
+    時点を追加しても既存の時点の値が変わらないことを確認する
+    """
+    print("【時点の追加】")
+    ok = True
+    for n_time in [len(values) // 2, len(values) - 52, len(values) - 1]:
+        mean_part, std_part = lib.rollingStatistics(values[:n_time], WINDOWS)
+        mean_all, std_all = lib.rollingStatistics(values, WINDOWS)
+        same = (np.array_equal(mean_part, mean_all[:, :n_time], equal_nan=True)
+                and np.array_equal(std_part, std_all[:, :n_time], equal_nan=True))
+        print(f"  先頭{n_time}時点: {'✅ 一致' if same else '❌ 不一致'}")
+        ok = ok and same
+    return ok
+
+
+def main():
+    print("=" * 60)
+    print("rollingStatistics の確認")
+    print("=" * 60)
+    values = make_values(1300)
+    results = [test_pandas_agreement(values), test_constant_window(values), test_prefix_stability(values)]
+
+    print("\n" + "=" * 60)
+    if all(results):
+        print("✅ rollingStatistics の確認: PASSED")
+        sys.exit(0)
+    else:
+        print("❌ rollingStatistics の確認: FAILED")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
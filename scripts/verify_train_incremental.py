@@ -0,0 +1,140 @@
+"""
+train の差分計算（最終年を進めた場合）の確認
+
+1. trainUnit: 途中の年までの結果に新しい年の分だけを追加した結果が、全期間を計算した結果とビット単位で一致し、
+   格子の計算（strategyTotal に渡す時点の数）が全期間の計算より少ないこと
+2. trainAll: 途中の年まで実行してから最終年まで進めた train_result_*.csv が、最初から実行した場合とバイト単位で一致すること
+"""
+
+import sys
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from pathlib import Path
+
+# lib.pyをインポート
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import lib
+
+
+def count_grid_rows():
+    """
+    lib.strategyTotal に渡された時点の数を数える（格子の計算量の目安）
+    """
+    counter = {"rows": 0}
+    original = lib.strategyTotal
+
+    def strategy_total(values_, rows_, allocation_):
+        counter["rows"] += len(rows_)
+        return original(values_, rows_, allocation_)
+
+    lib.strategyTotal = strategy_total
+    return counter
+
+
+def same_result(full, combined):
+    """
+    trainUnit の結果（年 → (個数, yearStatistics, 平均 または None)）がビット単位で一致するか
+    """
+    if sorted(full) != sorted(combined):
+        print(f"  [ERROR] 年が不一致: full={sorted(full)}, incremental={sorted(combined)}")
+        return False
+    ok = True
+    for year in sorted(full):
+        count_full, stats_full, fallback_full = full[year]
+        count_inc, stats_inc, fallback_inc = combined[year]
+        same = count_full == count_inc and np.array_equal(stats_full, stats_inc, equal_nan=True)
+        same = same and ((fallback_full is None and fallback_inc is None)
+                         or (fallback_full is not None and fallback_inc is not None
+                             and np.array_equal(fallback_full, fallback_inc, equal_nan=True)))
+        if not same:
+            print(f"  [ERROR] {year}年の結果が不一致")
+            ok = False
+    return ok
+
+
+def test_train_unit(job, position_id_1, position_id_2, last_year, split_year):
+    """
+    trainUnit で全期間の計算と差分計算を比較する
+    """
+    print("【trainUnit の差分計算】")
+    first_year = lib.trainFirstYear()
+    counter = count_grid_rows()
+
+    counter["rows"] = 0
+    full = lib.trainUnit(job, position_id_1, position_id_2, last_year)
+    full_rows = counter["rows"]
+
+    stored = lib.trainUnit(job, position_id_1, position_id_2, split_year)
+    from_year = lib.trainFromYear(stored, last_year, first_year)
+    counter["rows"] = 0
+    added = lib.trainUnit(job, position_id_1, position_id_2, last_year, from_year)
+    incremental_rows = counter["rows"]
+
+    combined = dict(stored)
+    combined.update(added)
+    print(f"  {job} ({position_id_1}, {position_id_2}): {first_year}〜{split_year} の結果に {from_year}〜{last_year} を追加")
+    print(f"  格子の計算時点数: 全期間={full_rows}, 差分={incremental_rows}")
+    ok = same_result(full, combined)
+    if ok:
+        print("  [OK] 全期間の計算とビット単位で一致")
+    if not (from_year == split_year + 1 and incremental_rows < full_rows):
+        print("  [ERROR] 差分計算になっていません（新しい年だけの計算になっていない）")
+        ok = False
+    return ok
+
+
+def test_train_all(job, last_year, split_year, positions):
+    """
+    trainAll で最初から実行した結果と、最終年を進めて差分計算した結果を比較する
+    """
+    print("【trainAll の差分計算】")
+    work = Path(tempfile.mkdtemp())
+    lib.TRAIN_CHECKPOINT_PATH = str(work / "train_checkpoint.sqlite")
+    lib.USE_RESULT_CACHE = False
+    lib.trainResultFile = lambda job_: str(work / ("train_result_" + job_ + ".csv"))
+    calculate_factor_return, first_simulation_period, calculate_weight, position_functions = lib.TRAIN_JOB[job]
+    lib.TRAIN_JOB[job] = (calculate_factor_return, first_simulation_period, calculate_weight,
+                          {i: position_functions[i] for i in range(positions)})
+    try:
+        lib.trainAll(last_year, jobs_=[job], maxWorkers_=1)
+        fresh = Path(lib.trainResultFile(job)).read_text()
+        Path(lib.TRAIN_CHECKPOINT_PATH).unlink()
+        lib.trainAll(split_year, jobs_=[job], maxWorkers_=1)
+        lib.trainAll(last_year, jobs_=[job], maxWorkers_=1)
+        incremental = Path(lib.trainResultFile(job)).read_text()
+    finally:
+        lib.TRAIN_JOB[job] = (calculate_factor_return, first_simulation_period, calculate_weight, position_functions)
+        shutil.rmtree(work, ignore_errors=True)
+    ok = fresh == incremental
+    print(f"  {job}（ポジション関数 {positions} 個）: {split_year} まで実行してから {last_year} まで進めた結果")
+    print("  [OK] 最初から実行した結果とバイト単位で一致" if ok else "  [ERROR] 最初から実行した結果と不一致")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='train の差分計算の確認')
+    parser.add_argument('--job', type=str, default='NY17NY17_C', help='ジョブ名（lib.TRAIN_JOB のキー）')
+    parser.add_argument('--last-year', type=int, default=2025, help='シミュレーション最終年')
+    parser.add_argument('--split-year', type=int, default=2020, help='最初に実行する最終年（この次の年から差分計算する）')
+    parser.add_argument('--positions', type=int, default=2, help='trainAll の確認に使うポジション関数の数')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("train の差分計算の確認")
+    print("=" * 60)
+    results = [test_train_unit(args.job, 0, 1, args.last_year, args.split_year),
+               test_train_all(args.job, args.last_year, args.split_year, args.positions)]
+
+    print("\n" + "=" * 60)
+    if all(results):
+        print("[OK] train の差分計算の確認: PASSED")
+        sys.exit(0)
+    else:
+        print("[ERROR] train の差分計算の確認: FAILED")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
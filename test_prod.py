@@ -23,19 +23,25 @@ LASTSIMULATIONPERIOD = date_.year
 
 if  date_.weekday() == TUESDAY  :
 
-	def run_proc1():
+	def run_proc1(marketData_):
+		lib.attachMarketData(marketData_)
 		lib.testForProd_NY17NY17_NY17NY17_NY17TK1630_A(LASTSIMULATIONPERIOD,date_)
 
-	def run_proc2():
+	def run_proc2(marketData_):
+		lib.attachMarketData(marketData_)
 		lib.testForProd_NY17NY17_NY17NY17_NY17TK1630_B(LASTSIMULATIONPERIOD,date_)
 
-	def run_proc3():
+	def run_proc3(marketData_):
+		lib.attachMarketData(marketData_)
 		lib.testForProd_NY17NY17_NY17NY17_NY17TK1630_C(LASTSIMULATIONPERIOD,date_)
 
 	if __name__ == "__main__":
-		p1 = Process(target=run_proc1)
-		p2 = Process(target=run_proc2)
-		p3 = Process(target=run_proc3)
+		for session_ in lib.MARKET_UPDATE:
+			lib.updateMarket(session_)
+		marketData_ = lib.shareMarketData()
+		p1 = Process(target=run_proc1, args=(marketData_,))
+		p2 = Process(target=run_proc2, args=(marketData_,))
+		p3 = Process(target=run_proc3, args=(marketData_,))
 
 		print('Child process will start.')
 		p1.start()
@@ -46,5 +52,6 @@ if  date_.weekday() == TUESDAY  :
 		p2.join()
 		p3.join()
 		print('Child process end.')
+		lib.releaseMarketData(marketData_)
 
 		lib.testForProd_NY17NY17_NY17NY17_NY17TK1630_TOTAL(date_)
@@ -8,21 +8,25 @@ LASTSIMULATIONPERIOD=int(sys.argv[1])
 
 
 
-def run_proc1():
+def run_proc1(marketData_):
+    lib.attachMarketData(marketData_)
     lib.testForSim_NY17NY17_NY17NY17_NY17TK1630_A(LASTSIMULATIONPERIOD)
 
-def run_proc2():
+def run_proc2(marketData_):
+	lib.attachMarketData(marketData_)
 	lib.testForSim_NY17NY17_NY17NY17_NY17TK1630_B(LASTSIMULATIONPERIOD)
 
-def run_proc3():
+def run_proc3(marketData_):
+	lib.attachMarketData(marketData_)
 	lib.testForSim_NY17NY17_NY17NY17_NY17TK1630_C(LASTSIMULATIONPERIOD)
 
 
 
 if __name__ == "__main__":
-	p1 = Process(target=run_proc1)
-	p2 = Process(target=run_proc2)
-	p3 = Process(target=run_proc3)
+	marketData_ = lib.shareMarketData()
+	p1 = Process(target=run_proc1, args=(marketData_,))
+	p2 = Process(target=run_proc2, args=(marketData_,))
+	p3 = Process(target=run_proc3, args=(marketData_,))
 
 	print('Child process will start.')
 	p1.start()
@@ -33,5 +37,6 @@ if __name__ == "__main__":
 	p2.join()
 	p3.join()
 	print('Child process end.')
+	lib.releaseMarketData(marketData_)
 
 	lib.testForSim_NY17NY17_NY17NY17_NY17TK1630_TOTAL()
@@ -1,50 +1,26 @@
 import sys
 sys.dont_write_bytecode = True
 import lib as lib
-from multiprocessing import Process
 import sys
 LASTSIMULATIONPERIOD=2025
 
-def run_proc1():
-    lib.train_NY17TK20_A( LASTSIMULATIONPERIOD)
-
-def run_proc2():
-	lib.train_NY17TK20_B( LASTSIMULATIONPERIOD)
-
-def run_proc3():
-	lib.train_NY17TK20_C( LASTSIMULATIONPERIOD)
-
-def run_proc4():
-	lib.train_NY17NY17_A( LASTSIMULATIONPERIOD)
-
-def run_proc5():
-	lib.train_NY17NY17_B( LASTSIMULATIONPERIOD)
-
-def run_proc6():
-	lib.train_NY17NY17_C( LASTSIMULATIONPERIOD)
-
+# 複数ホストで実行する場合（TRAIN_AUTHKEY を全ホストで同じ値に設定する）
+#   python train.py --coordinator [HOST:]PORT [--worker-timeout SECONDS]
+#   python train.py --worker HOST:PORT
+# --worker-timeout: 作業単位の結果がこの秒数返らなければ別のワーカーに再投入する（省略時は lib.TRAIN_UNIT_TIMEOUT）
 if __name__ == "__main__":
-	p1 = Process(target=run_proc1)
-	p2 = Process(target=run_proc2)
-	p3 = Process(target=run_proc3)
-	p4 = Process(target=run_proc4)
-	p5 = Process(target=run_proc5)
-	p6 = Process(target=run_proc6)
-
-	print('Child process will start.')
-	p1.start()
-	p2.start()
-	p3.start()
-	p4.start()
-	p5.start()
-	p6.start()
-
-	p1.join()
-	p2.join()
-	p3.join()
-	p4.join()
-	p5.join()
-	p6.join()
-	print('Child process end.')
-    
-
+	if len(sys.argv) > 2 and sys.argv[1] == "--coordinator":
+		unitTimeout_ = None
+		if "--worker-timeout" in sys.argv[3:]:
+			unitTimeout_ = float(sys.argv[sys.argv.index("--worker-timeout") + 1])
+		lib.trainCoordinator( LASTSIMULATIONPERIOD, lib.parseAddress(sys.argv[2]), unitTimeout_ = unitTimeout_)
+	elif len(sys.argv) > 2 and sys.argv[1] == "--worker":
+		lib.trainWorker(lib.parseAddress(sys.argv[2]))
+	else:
+		marketData_ = lib.shareMarketData()
+
+		print('Train work units will start.')
+		# 全ジョブを (ジョブ, ポジションの組) の作業単位に分けて CPU 数のプロセスで実行する
+		lib.trainAll( LASTSIMULATIONPERIOD, marketData_)
+		print('Train work units end.')
+		lib.releaseMarketData(marketData_)